@@ -2,93 +2,28 @@
 # -*- coding: utf-8 -*-
 """
 PDF水印工具 - Vercel部署版本
-整合了所有功能到单个文件中
+Web界面与水印工具类在单个文件中，处理接口复用 web_backend，图片/PDF处理复用 watermark_tool.WatermarkTool
 """
 
-from flask import Flask, request, send_file, render_template_string, jsonify
-import os
-import re
-import sys
-import glob
-import tempfile
-import zipfile
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template_string
 import io
-from PIL import Image
-from PyPDF2 import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.colors import Color
+from watermark_tool import OverlayCache, WatermarkTool as BaseWatermarkTool
+import web_backend
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB限制
+# Helvetica水印与 watermark_tool 默认水印不同，单独缓存
+overlay_cache = OverlayCache()
 
-class WatermarkTool:
-    def __init__(self):
-        self.default_watermark_text = "朋阳托辅内部专用资料"
-        self.default_font_size = 32
-        self.default_opacity = 0.35
-        self.default_rotation = 45
-        
-    def extract_page_number(self, filename):
-        """从文件名中提取页码数字"""
-        match = re.search(r'页面_(\d+)', filename)
-        if match:
-            return int(match.group(1))
-        return 0
+class WatermarkTool(BaseWatermarkTool):
+    """Vercel版水印工具：不注册中文字体，统一使用Helvetica"""
 
-    def create_pdf_from_images(self, image_folder, output_pdf):
-        """将图片按页码顺序合并成PDF"""
-        print(f"正在扫描图片文件夹: {image_folder}")
-        
-        # 支持的图片格式
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff']
-        image_files = []
-        
-        for ext in image_extensions:
-            image_files.extend(glob.glob(os.path.join(image_folder, ext)))
-            image_files.extend(glob.glob(os.path.join(image_folder, ext.upper())))
-        
-        print(f"找到 {len(image_files)} 个图片文件")
-        
-        if not image_files:
-            print("错误：没有找到图片文件")
-            return False
-        
-        # 按页码排序
-        image_files.sort(key=lambda x: self.extract_page_number(os.path.basename(x)))
-        
-        print("开始转换图片为PDF...")
-        
-        # 转换第一张图片
-        first_image = Image.open(image_files[0])
-        if first_image.mode != 'RGB':
-            first_image = first_image.convert('RGB')
-        
-        # 准备其他图片
-        other_images = []
-        for i, img_path in enumerate(image_files[1:], 1):
-            if i % 10 == 0:
-                print(f"处理第 {i+1} 张图片...")
-            
-            img = Image.open(img_path)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            other_images.append(img)
-        
-        # 保存为PDF
-        print(f"正在保存PDF文件: {output_pdf}")
-        first_image.save(
-            output_pdf,
-            save_all=True,
-            append_images=other_images,
-            format='PDF'
-        )
-        
-        print(f"✅ PDF创建成功！包含 {len(image_files)} 页")
-        return True
+    def __init__(self, **kwargs):
+        super().__init__(overlay_cache=overlay_cache, **kwargs)
+
+    def watermark_font(self):
+        """水印固定使用Helvetica，计算缓存键时不需要加载中文字体"""
+        return 'Helvetica', None
 
     def create_watermark_pdf(self, width, height, watermark_text, font_size):
         """创建水印PDF"""
@@ -137,44 +72,9 @@ class WatermarkTool:
         packet.seek(0)
         return packet
 
-    def add_watermark_to_pdf(self, input_pdf, output_pdf, watermark_text, font_size):
-        """为PDF添加水印"""
-        try:
-            reader = PdfReader(input_pdf)
-            writer = PdfWriter()
-            
-            print(f"正在为PDF添加水印，总页数: {len(reader.pages)}")
-            
-            for page_num, page in enumerate(reader.pages):
-                if page_num % 20 == 0:
-                    print(f"添加水印到第 {page_num + 1} 页...")
-                
-                # 获取页面尺寸
-                page_box = page.mediabox
-                page_width = float(page_box.width)
-                page_height = float(page_box.height)
-                
-                # 创建水印
-                watermark_packet = self.create_watermark_pdf(
-                    page_width, page_height, watermark_text, font_size
-                )
-                watermark_reader = PdfReader(watermark_packet)
-                watermark_page = watermark_reader.pages[0]
-                
-                # 合并水印
-                page.merge_page(watermark_page)
-                writer.add_page(page)
-            
-            # 保存结果
-            with open(output_pdf, 'wb') as output_file:
-                writer.write(output_file)
-            
-            print(f"✅ 水印添加完成！")
-            return True
-            
-        except Exception as e:
-            print(f"添加水印时出错: {e}")
-            return False
+app = Flask(__name__)
+# 处理接口（提交任务、查询状态、下载、进度、缓存统计）见 web_backend
+web_backend.init_app(app, WatermarkTool, 'PENYANG TUTOR INTERNAL USE')
 
 # HTML模板
 HTML_TEMPLATE = '''
@@ -354,6 +254,11 @@ HTML_TEMPLATE = '''
                                oninput="document.getElementById('fontSizeValue').textContent = this.value">
                         <span id="fontSizeValue">32</span> px
                     </div>
+                    <div class="form-group">
+                        <label for="pages">水印页码 (PDF模式，可选)</label>
+                        <input type="text" id="pages" name="pages" 
+                               placeholder="留空为全部页面，如 1-3,last 或 */2">
+                    </div>
                 </div>
                 
                 <button type="submit" class="btn" id="submitBtn">
@@ -362,7 +267,7 @@ HTML_TEMPLATE = '''
             </form>
             
             <div class="progress" id="progress">
-                <p>正在处理中，请稍候...</p>
+                <p id="progressText">正在处理中，请稍候...</p>
                 <div class="progress-bar">
                     <div class="progress-fill" id="progressFill"></div>
                 </div>
@@ -399,6 +304,8 @@ HTML_TEMPLATE = '''
         const progress = document.getElementById('progress');
         const result = document.getElementById('result');
         const fileInput = document.getElementById('fileInput');
+        const progressFill = document.getElementById('progressFill');
+        const progressText = document.getElementById('progressText');
         const modeRadios = document.querySelectorAll('input[name="mode"]');
         
         // 根据模式切换文件类型
@@ -420,6 +327,7 @@ HTML_TEMPLATE = '''
             const mode = document.querySelector('input[name="mode"]:checked').value;
             const watermarkText = document.getElementById('watermarkText').value;
             const fontSize = document.getElementById('fontSize').value;
+            const pages = document.getElementById('pages').value;
             
             if (!file) {
                 alert('请选择文件');
@@ -430,36 +338,62 @@ HTML_TEMPLATE = '''
             formData.append('mode', mode);
             formData.append('watermarkText', watermarkText);
             formData.append('fontSize', fontSize);
+            formData.append('pages', pages);
             
             // 显示进度
             submitBtn.disabled = true;
+            progressFill.style.width = '0%';
+            progressText.textContent = '正在上传，请稍候...';
             progress.style.display = 'block';
             result.style.display = 'none';
             
             try {
+                // 提交任务，立即返回任务ID
                 const response = await fetch('/process', {
                     method: 'POST',
                     body: formData
                 });
+                if (!response.ok) {
+                    throw new Error(await response.text());
+                }
+                const job = await response.json();
+                progressText.textContent = '排队等待处理...';
+                
+                // 订阅处理进度（SSE），结束后查询最终状态
+                await new Promise(resolve => {
+                    const events = new EventSource(job.progressUrl);
+                    events.onmessage = function(e) {
+                        const ev = JSON.parse(e.data);
+                        if (!ev.total) return;
+                        progressFill.style.width = `${(ev.done / ev.total * 100).toFixed(1)}%`;
+                        let text = `已处理 ${ev.done}/${ev.total} 页`;
+                        if (ev.eta !== null && ev.done < ev.total) {
+                            text += `，预计剩余 ${Math.ceil(ev.eta)} 秒`;
+                        }
+                        progressText.textContent = text;
+                    };
+                    events.addEventListener('done', () => { events.close(); resolve(); });
+                    events.onerror = () => { events.close(); resolve(); };
+                });
                 
-                if (response.ok) {
-                    const blob = await response.blob();
-                    const url = window.URL.createObjectURL(blob);
-                    const filename = response.headers.get('Content-Disposition')
-                        ?.split('filename=')[1]?.replace(/"/g, '') || 'watermarked.pdf';
-                    
-                    document.getElementById('downloadLink').href = url;
-                    document.getElementById('downloadLink').download = filename;
-                    document.getElementById('resultMessage').textContent = 
-                        `文件处理完成！大小: ${(blob.size / 1024 / 1024).toFixed(2)} MB`;
-                    
-                    result.style.display = 'block';
-                } else {
-                    const error = await response.text();
-                    alert('处理失败: ' + error);
+                // SSE中断时轮询任务状态
+                let status = await (await fetch(job.statusUrl)).json();
+                while (status.status === 'queued' || status.status === 'running') {
+                    await new Promise(resolve => setTimeout(resolve, 2000));
+                    status = await (await fetch(job.statusUrl)).json();
                 }
+                if (status.status !== 'done') {
+                    throw new Error(status.error || '处理失败');
+                }
+                
+                progressFill.style.width = '100%';
+                document.getElementById('downloadLink').href = job.downloadUrl;
+                document.getElementById('resultMessage').textContent = 
+                    `文件处理完成！大小: ${(status.size / 1024 / 1024).toFixed(2)} MB`;
+                
+                result.style.display = 'block';
             } catch (error) {
-                alert('上传失败: ' + error.message);
+                alert('处理失败: ' + error.message);
             } finally {
                 submitBtn.disabled = false;
                 progress.style.display = 'none';
@@ -475,78 +409,6 @@ def index():
     """主页"""
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/process', methods=['POST'])
-def process_file():
-    """处理上传的文件"""
-    try:
-        # 获取参数
-        mode = request.form.get('mode', 'pdf')
-        watermark_text = request.form.get('watermarkText', 'PENYANG TUTOR INTERNAL USE')
-        font_size = int(request.form.get('fontSize', 32))
-        
-        if 'file' not in request.files:
-            return '没有上传文件', 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return '没有选择文件', 400
-        
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, secure_filename(file.filename))
-            file.save(input_path)
-            
-            tool = WatermarkTool()
-            
-            if mode == 'pdf':
-                # PDF模式
-                output_path = os.path.join(temp_dir, 'output_watermarked.pdf')
-                success = tool.add_watermark_to_pdf(
-                    input_path, output_path, watermark_text, font_size
-                )
-                output_filename = f"{os.path.splitext(file.filename)[0]}_带水印.pdf"
-                
-            else:
-                # 文件夹模式
-                extract_dir = os.path.join(temp_dir, 'extracted')
-                os.makedirs(extract_dir)
-                
-                # 解压ZIP文件
-                with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                
-                output_path = os.path.join(temp_dir, 'output_from_images.pdf')
-                
-                # 先转换为PDF，再添加水印
-                temp_pdf = os.path.join(temp_dir, 'temp_from_images.pdf')
-                if tool.create_pdf_from_images(extract_dir, temp_pdf):
-                    success = tool.add_watermark_to_pdf(
-                        temp_pdf, output_path, watermark_text, font_size
-                    )
-                else:
-                    success = False
-                    
-                output_filename = f"{os.path.splitext(file.filename)[0]}_带水印.pdf"
-            
-            if not success:
-                return '处理失败', 500
-            
-            # 返回处理后的文件
-            return send_file(
-                output_path,
-                as_attachment=True,
-                download_name=output_filename,
-                mimetype='application/pdf'
-            )
-            
-    except Exception as e:
-        return f'处理出错: {str(e)}', 500
-
-@app.route('/health')
-def health():
-    """健康检查"""
-    return {'status': 'ok', 'message': 'PDF水印工具运行正常'}
-
 # Vercel需要的handler
 def handler(event, context):
     return app(event, context)
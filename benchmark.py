@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF水印工具 - 性能基准测试
+功能：
+1. 生成可复现的测试输入：不同页数、混合页面尺寸的PDF，不同DPI的JPEG/PNG扫描图片文件夹
+2. 分别运行 process_pdf_watermark 和 process_folder_to_pdf
+3. 以JSON输出 页/秒、峰值内存(RSS)、输出文件大小、各阶段耗时，并可与上一次结果对比
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import contextlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, A5, letter, landscape
+from watermark_tool import WatermarkTool, parse_args
+
+DEFAULT_PDF_PAGES = [10, 100, 1000, 10000]
+DEFAULT_DPIS = [100, 200, 300]
+DEFAULT_IMAGE_COUNT = 20
+DEFAULT_WORK_DIR = 'benchmark_data'
+
+# 必须以 --名称=值 形式给出的选项
+VALUE_OPTIONS = ('pdf-pages', 'dpis', 'images', 'repeat', 'work-dir', 'output', 'compare')
+
+# 混合页面尺寸，按页码轮换
+PAGE_SIZES = [A4, letter, A5, landscape(A4)]
+
+# A4 纸张尺寸（英寸），用于按DPI计算扫描图片像素
+A4_INCHES = (8.27, 11.69)
+
+# 与上次结果相比变慢超过该比例视为性能回退
+REGRESSION_THRESHOLD = 0.10
+
+
+def make_pdf(path, pages):
+    """生成指定页数、混合页面尺寸的PDF"""
+    rng = random.Random(pages)
+    c = canvas.Canvas(path)
+    for page in range(pages):
+        width, height = PAGE_SIZES[page % len(PAGE_SIZES)]
+        c.setPageSize((width, height))
+        c.setFont('Helvetica', 10)
+        for line in range(int(height // 14) - 6):
+            words = ' '.join(rng.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet']) for _ in range(12))
+            c.drawString(40, height - 40 - line * 14, f"{page + 1}-{line} {words}")
+        c.showPage()
+    c.save()
+
+
+def make_images(folder, fmt, dpi, count):
+    """生成模拟扫描页的图片文件夹（文件名带页码，格式为 JPEG 或 PNG）"""
+    os.makedirs(folder, exist_ok=True)
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    ext = 'jpg' if fmt == 'JPEG' else 'png'
+    for index in range(1, count + 1):
+        rng = random.Random(index * 1000 + dpi)
+        # 浅色噪声背景模拟纸张纹理，再画上若干“文字行”
+        noise = Image.effect_noise((width, height), 12).point(lambda v: 235 + v // 16)
+        image = Image.merge('RGB', (noise, noise, noise))
+        draw = ImageDraw.Draw(image)
+        line_height = max(dpi // 6, 8)
+        for y in range(dpi // 2, height - dpi // 2, line_height):
+            x_end = rng.randint(width // 2, width - dpi // 2)
+            draw.rectangle([dpi // 2, y, x_end, y + line_height // 3], fill=(40, 40, 40))
+        image.save(os.path.join(folder, f"页面_{index:03d}.{ext}"), fmt)
+
+
+def prepare_inputs(work_dir, pdf_pages, dpis, image_count):
+    """生成（或复用已生成的）测试输入，返回测试用例列表"""
+    os.makedirs(work_dir, exist_ok=True)
+    cases = []
+    for pages in pdf_pages:
+        path = os.path.join(work_dir, f"pdf_{pages}.pdf")
+        if not os.path.exists(path):
+            print(f"生成测试PDF: {pages} 页")
+            make_pdf(path, pages)
+        cases.append({'name': f"pdf_{pages}", 'mode': 'pdf', 'input': path, 'pages': pages})
+    for fmt in ('JPEG', 'PNG'):
+        for dpi in dpis:
+            folder = os.path.join(work_dir, f"images_{fmt.lower()}_{dpi}dpi_{image_count}")
+            if not os.path.isdir(folder):
+                print(f"生成测试图片: {fmt} {dpi}dpi x {image_count}")
+                make_images(folder, fmt, dpi, image_count)
+            cases.append({
+                'name': f"folder_{fmt.lower()}_{dpi}dpi",
+                'mode': 'folder', 'input': folder, 'pages': image_count,
+            })
+    return cases
+
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    # Linux 上 ru_maxrss 会继承 exec 之前父进程的峰值，优先读取 VmHWM
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 为KB
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(case, output_pdf):
+    """在独立子进程中运行一个用例，返回测量结果"""
+    tool = WatermarkTool()
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if case['mode'] == 'pdf':
+            stats = tool.process_pdf_watermark(case['input'], output_pdf)
+        else:
+            stats = tool.process_folder_to_pdf(case['input'], output_pdf)
+    seconds = time.perf_counter() - start
+    output_bytes = os.path.getsize(output_pdf) if os.path.exists(output_pdf) else 0
+    if os.path.exists(output_pdf):
+        os.remove(output_pdf)
+    return {
+        'case': case['name'],
+        'mode': case['mode'],
+        'success': bool(stats),
+        'pages': case['pages'],
+        'seconds': round(seconds, 4),
+        'pages_per_sec': round(case['pages'] / seconds, 2) if seconds > 0 else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline_rss, 1),
+        'output_bytes': output_bytes,
+        'stages': stats.to_dict()['stages'],
+    }
+
+
+def run_benchmark(cases, work_dir, repeat=1):
+    """依次运行所有用例（每次使用新进程，峰值内存互不影响），取最快的一次"""
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        best = None
+        for _ in range(repeat):
+            output_pdf = os.path.join(work_dir, f"out_{case['name']}.pdf")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_case, case, output_pdf).result()
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        print(f"{best['case']:<24} {best['pages_per_sec'] or 0:>10.1f} 页/秒 "
+              f"{best['peak_rss_mb']:>8.1f} MB {best['output_bytes'] / 1024 / 1024:>8.2f} MB")
+        results.append(best)
+    return results
+
+
+def compare(results, previous_path):
+    """与上一次的结果对比，返回性能回退的用例列表"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = {item['case']: item for item in json.load(f)['results']}
+
+    regressions = []
+    print(f"\n与 {previous_path} 对比:")
+    for result in results:
+        old = previous.get(result['case'])
+        if not old or not old.get('pages_per_sec') or not result['pages_per_sec']:
+            continue
+        change = result['pages_per_sec'] / old['pages_per_sec'] - 1
+        flag = ''
+        if change < -REGRESSION_THRESHOLD:
+            flag = '  ⚠️ 回退'
+            regressions.append(result['case'])
+        print(f"{result['case']:<24} 速度 {change:+.1%}  "
+              f"内存 {result['peak_rss_mb'] - old['peak_rss_mb']:+.1f} MB  "
+              f"大小 {result['output_bytes'] - old['output_bytes']:+d} B{flag}")
+    return regressions
+
+
+def show_usage():
+    """显示使用说明"""
+    print("python3 benchmark.py [选项]")
+    print("  --pdf-pages=10,100,1000,10000  测试PDF的页数")
+    print("  --dpis=100,200,300             测试图片的DPI")
+    print("  --images=20                    每个图片文件夹的图片数量")
+    print("  --repeat=1                     每个用例运行次数（取最快一次）")
+    print("  --work-dir=benchmark_data      测试输入的生成目录（已生成的输入会复用）")
+    print("  --output=FILE.json             结果JSON写入文件（默认输出到屏幕）")
+    print("  --compare=FILE.json            与上一次的结果对比，有性能回退时返回非零状态")
+
+
+def main():
+    """主程序"""
+    args, options = parse_args(sys.argv[1:])
+    for name in VALUE_OPTIONS:
+        if options.get(name) is True:
+            print(f"❌ 错误：选项 --{name} 需要一个值，格式为 --{name}=值")
+            show_usage()
+            return 2
+    if args or 'help' in options:
+        show_usage()
+        return 0
+
+    def int_list(name, default):
+        value = options.get(name)
+        return [int(v) for v in value.split(',')] if isinstance(value, str) else default
+
+    pdf_pages = int_list('pdf-pages', DEFAULT_PDF_PAGES)
+    dpis = int_list('dpis', DEFAULT_DPIS)
+    image_count = int(options.get('images', DEFAULT_IMAGE_COUNT))
+    repeat = int(options.get('repeat', 1))
+    work_dir = options.get('work-dir', DEFAULT_WORK_DIR)
+
+    cases = prepare_inputs(work_dir, pdf_pages, dpis, image_count)
+    print(f"\n{'用例':<22} {'速度':>12} {'峰值内存':>10} {'输出大小':>10}")
+    results = run_benchmark(cases, work_dir, repeat)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if 'output' in options:
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"\n结果已写入: {options['output']}")
+    else:
+        print(text)
+
+    if 'compare' in options and compare(results, options['compare']):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF水印工具 - 后台任务队列
+功能：
+1. 提交任务后立即返回任务ID，由固定数量的后台线程处理
+2. 排队任务数有上限，队列已满时拒绝提交
+3. 完成的任务保留一段时间供查询和下载，过期后删除其工作目录
+4. OutputPipe 把处理线程写出的字节逐块交给HTTP响应，实现边处理边发送
+只使用标准库，本地运行不需要任何外部服务
+"""
+
+import os
+import time
+import queue
+import shutil
+import tempfile
+import threading
+import uuid
+from watermark_tool import ProgressChannel
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+
+
+class OutputPipe:
+    """处理线程写入、响应线程读取的字节管道
+
+    写入的数据攒够 CHUNK_SIZE 后作为一块交给读取方；缓冲的块数有上限，读取方跟不上时写入方阻塞，
+    内存占用固定。读取方提前断开时调用 cancel()，之后的 write() 抛出 BrokenPipeError 以终止处理。
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_chunks=16):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise BrokenPipeError("客户端已断开连接")
+
+    def write(self, data):
+        if self._cancelled.is_set():
+            raise BrokenPipeError("客户端已断开连接")
+        self._buffer += data
+        if len(self._buffer) >= self.CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self, error=None):
+        """写入结束；error 不为None时读取方会收到该异常"""
+        try:
+            if error is None:
+                self.flush()
+            self._put(error if error is not None else None)
+        except BrokenPipeError:
+            pass
+
+    def cancel(self):
+        """读取方放弃读取"""
+        self._cancelled.set()
+
+    def read(self):
+        """读取下一块数据，写入结束时返回None，处理出错时抛出写入方传入的异常"""
+        item = self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+
+class Job:
+    """一个后台任务：func(job) 在工作线程中执行，返回值保存为 result"""
+
+    def __init__(self, func, work_dir, download_name=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.work_dir = work_dir
+        self.download_name = download_name
+        self.status = 'queued'  # queued / running / done / failed
+        self.result = None
+        self.error = None
+        self.progress = ProgressChannel()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        """任务状态（用于JSON响应）"""
+        info = {
+            'jobId': self.id,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': self.progress.event,
+        }
+        if self.error is not None:
+            info['error'] = self.error
+        if self.status == 'done' and self.result and os.path.exists(self.result):
+            info['size'] = os.path.getsize(self.result)
+        return info
+
+
+class JobQueue:
+    """有界任务队列 + 固定大小的后台线程池"""
+
+    def __init__(self, workers=2, max_queued=16, result_ttl=3600):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"watermark-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def full(self):
+        """排队中的任务是否已达上限"""
+        return self._queue.full()
+
+    def create_work_dir(self):
+        """为新任务创建工作目录"""
+        return tempfile.mkdtemp(prefix='watermark_job_')
+
+    def submit(self, func, work_dir, download_name=None):
+        """提交任务，返回 Job；队列已满时删除工作目录并抛出 QueueFullError"""
+        self.cleanup()
+        job = Job(func, work_dir, download_name)
+        with self._lock:
+            self.jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self.jobs[job.id]
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise QueueFullError(f"任务队列已满（最多 {self.max_queued} 个排队任务）")
+        return job
+
+    def get(self, job_id):
+        """按ID查询任务，不存在或已过期时返回None"""
+        self.cleanup()
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cleanup(self):
+        """删除已过期的任务及其工作目录"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job for job in self.jobs.values()
+                if job.finished is not None and now - job.finished > self.result_ttl
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def _worker(self):
+        """工作线程：依次取出任务并执行"""
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started = time.time()
+            try:
+                job.result = job.func(job)
+                job.status = 'done'
+            except Exception as e:
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.func = None
+                job.finished = time.time()
+                job.progress.finish()
+                self._queue.task_done()
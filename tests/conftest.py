@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""测试公用的夹具：生成小型测试PDF、创建不输出进度的水印工具"""
+
+import os
+import sys
+
+import pytest
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ContentStream
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# 各模块都在仓库根目录下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watermark_tool import WatermarkTool  # noqa: E402
+
+
+def make_pdf(path, pages=3, links=False, pagesize=A4):
+    """生成每页带一行文字的PDF；links=True 时每页加一个相同的链接注释"""
+    c = canvas.Canvas(str(path), pagesize=pagesize)
+    for number in range(1, pages + 1):
+        c.setFont('Helvetica', 14)
+        c.drawString(72, 720, f"Page {number}")
+        if links:
+            c.linkURL('https://example.com/', (72, 700, 200, 740))
+        c.showPage()
+    c.save()
+    return str(path)
+
+
+def text_operations(path, page_number=0):
+    """统计页面（含其引用的 Form XObject）中的文字绘制指令数"""
+    reader = PdfReader(path)
+    page = reader.pages[page_number]
+
+    def walk(operations, resources):
+        count = 0
+        xobjects = resources.get('/XObject', {}) if resources is not None else {}
+        for operands, operator in operations:
+            if operator in (b'Tj', b'TJ'):
+                count += 1
+            elif operator == b'Do':
+                xobject = xobjects[operands[0]].get_object()
+                if xobject.get('/Subtype') == '/Form':
+                    form_resources = xobject.get('/Resources', resources)
+                    count += walk(ContentStream(xobject, reader).operations, form_resources.get_object())
+        return count
+
+    return walk(ContentStream(page.get_contents(), reader).operations, page['/Resources'].get_object())
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    return make_pdf(tmp_path / 'sample.pdf')
+
+
+@pytest.fixture
+def tool():
+    return WatermarkTool(progress=lambda event: None)
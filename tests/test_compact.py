@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""输出优化（PdfCompactor）"""
+
+import shutil
+
+import pytest
+from PyPDF2 import PdfReader
+
+from conftest import make_pdf
+
+
+@pytest.fixture
+def watermarked(tmp_path, tool):
+    """带链接注释、已添加水印的PDF，以及优化后的副本"""
+    source = make_pdf(tmp_path / 'links.pdf', pages=4, links=True)
+    output = str(tmp_path / 'watermarked.pdf')
+    assert tool.add_watermark_to_pdf(source, output, 'compact', 24)
+    compacted = str(tmp_path / 'compacted.pdf')
+    shutil.copy(output, compacted)
+    tool.compact_file(compacted)
+    return output, compacted
+
+
+def test_pages_and_text_unchanged(watermarked):
+    original, compacted = (PdfReader(path) for path in watermarked)
+    assert compacted.pdf_header == '%PDF-1.5'
+    assert len(compacted.pages) == len(original.pages) == 4
+    for before, after in zip(original.pages, compacted.pages):
+        assert after.extract_text() == before.extract_text()
+        assert after.mediabox == before.mediabox
+
+
+def test_annotations_not_merged(watermarked):
+    """各页内容相同的链接注释仍是各自独立的对象"""
+    reader = PdfReader(watermarked[1])
+    annotations = [annot.idnum for page in reader.pages for annot in page['/Annots']]
+    assert len(annotations) == 4
+    assert len(set(annotations)) == 4
+    for annot in annotations:
+        assert reader.get_object(annot)['/A']['/URI'] == 'https://example.com/'
+
+
+def test_stats(tool, watermarked):
+    counters = tool.stats.to_dict()['counters']
+    assert counters['compact_bytes_after'] <= counters['compact_bytes_before']
+    assert counters['streams_compressed'] > 0
+
+
+def test_opens_in_pikepdf(watermarked):
+    pikepdf = pytest.importorskip('pikepdf')
+    with pikepdf.open(watermarked[1]) as pdf:
+        assert len(pdf.pages) == 4
+        for page in pdf.pages:
+            page.Contents.read_bytes()
+        assert pdf.get_warnings() == []
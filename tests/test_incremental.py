@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""增量更新方式添加水印"""
+
+import re
+
+import pytest
+from PyPDF2 import PdfReader
+
+
+def startxrefs(data):
+    return [int(offset) for offset in re.findall(rb'startxref\s+(\d+)', data)]
+
+
+def previous_xref(data, offset):
+    """offset 处交叉引用段的 trailer 中 /Prev 指向的位置"""
+    match = re.compile(rb'/Prev\s+(\d+)').search(data, offset)
+    return int(match.group(1)) if match else None
+
+
+@pytest.fixture
+def updated_twice(tmp_path, tool, sample_pdf):
+    first = str(tmp_path / 'first.pdf')
+    second = str(tmp_path / 'second.pdf')
+    assert tool.add_watermark_to_pdf(sample_pdf, first, 'first', 24, incremental=True)
+    assert tool.add_watermark_to_pdf(first, second, 'second', 24, incremental=True)
+    return first, second
+
+
+def test_original_bytes_preserved(sample_pdf, updated_twice):
+    """增量更新只在原文件之后追加"""
+    with open(sample_pdf, 'rb') as f:
+        original = f.read()
+    first, second = updated_twice
+    with open(first, 'rb') as f:
+        first_data = f.read()
+    with open(second, 'rb') as f:
+        second_data = f.read()
+    assert first_data.startswith(original)
+    assert second_data.startswith(first_data)
+
+
+def test_prev_chain(sample_pdf, updated_twice):
+    """每次更新的 trailer 用 /Prev 指向上一个交叉引用段"""
+    with open(updated_twice[1], 'rb') as f:
+        data = f.read()
+    offsets = startxrefs(data)
+    assert len(offsets) == 3
+    original, first, second = offsets
+    assert previous_xref(data, second) == first
+    assert previous_xref(data, first) == original
+    assert len(PdfReader(updated_twice[1]).pages) == 3
+
+
+def test_opens_in_pikepdf(updated_twice):
+    """qpdf 不需要修复交叉引用即可读取所有页面"""
+    pikepdf = pytest.importorskip('pikepdf')
+    with pikepdf.open(updated_twice[1]) as pdf:
+        assert len(pdf.pages) == 3
+        for page in pdf.pages:
+            page.Resources.XObject.keys()
+        assert pdf.get_warnings() == []
+
+
+def test_selected_pages_only(tmp_path, tool, sample_pdf):
+    """只追加选中的页面"""
+    output = str(tmp_path / 'out.pdf')
+    assert tool.add_watermark_to_pdf(sample_pdf, output, 'x', 24, incremental=True, pages='2')
+    with open(sample_pdf, 'rb') as f:
+        original_size = len(f.read())
+    with open(output, 'rb') as f:
+        appended = f.read()[original_size:]
+    assert len(re.findall(rb'/Type\s*/Page\b', appended)) == 1
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""部分页面添加水印（PageSelection）"""
+
+import pytest
+
+from conftest import make_pdf, text_operations
+from watermark_tool import PageSelection
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('1', [0]),
+    ('3-5', [2, 3, 4]),
+    ('8-', [7, 8, 9]),
+    ('-2', [0, 1]),
+    ('first', [0]),
+    ('last', [9]),
+    ('8-last', [7, 8, 9]),
+    ('*', list(range(10))),
+    ('*/3', [0, 3, 6, 9]),
+    ('2-/2', [1, 3, 5, 7, 9]),
+    ('1-4/2, 9, 3', [0, 2, 8]),
+    ('5-20', [4, 5, 6, 7, 8, 9]),
+    ('last, first, last', [0, 9]),
+])
+def test_indices(spec, expected):
+    assert PageSelection(spec).indices(10) == expected
+
+
+@pytest.mark.parametrize('spec', ['', ' , ', '0', '1-2-3', 'abc', '2/2', '*/0', '5-3', '3-first'])
+def test_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        PageSelection(spec)
+
+
+@pytest.mark.parametrize('spec', ['11', '11-', '20-30', 'last-3'])
+def test_selects_no_pages(spec):
+    """超出总页数、选不到任何页面的规格在展开时报错"""
+    selection = PageSelection(spec)
+    with pytest.raises(ValueError):
+        selection.indices(10)
+
+
+def test_str_round_trip():
+    selection = PageSelection('1, 3-last/2, */4')
+    assert str(selection) == '1,3-last/2,1-last/4'
+    assert PageSelection(str(selection)).indices(12) == selection.indices(12)
+
+
+def test_resolve_sequences():
+    assert PageSelection.resolve(None, 3) == [0, 1, 2]
+    assert PageSelection.resolve([2, 0, 2], 3) == [0, 2]
+    with pytest.raises(ValueError):
+        PageSelection.resolve([3], 3)
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'xobject': True}, {'stream': True}, {'incremental': True}, {'xobject': True, 'workers': 2},
+])
+def test_only_selected_pages_watermarked(tmp_path, tool, options):
+    source = make_pdf(tmp_path / 'in.pdf', pages=6)
+    output = str(tmp_path / 'out.pdf')
+    assert tool.add_watermark_to_pdf(source, output, 'MARK', 24, pages='2, last', **options)
+    marked = [index for index in range(6) if text_operations(output, index) > text_operations(source, index)]
+    assert marked == [1, 5]
+
+
+def test_empty_selection_fails(tmp_path, tool):
+    """选不到任何页面时不写出结果"""
+    source = make_pdf(tmp_path / 'in.pdf', pages=3)
+    output = tmp_path / 'out.pdf'
+    assert not tool.add_watermark_to_pdf(source, str(output), 'MARK', 24, pages='5-')
+    assert not output.exists()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""共享 Form XObject 方式添加水印"""
+
+import pytest
+from PyPDF2 import PdfReader
+
+from conftest import text_operations
+
+
+@pytest.mark.parametrize('options', [
+    {}, {'xobject': True}, {'stream': True}, {'incremental': True},
+])
+def test_restamp_keeps_existing_watermark(tmp_path, tool, sample_pdf, options):
+    """为已带水印的PDF再次添加水印时，原有水印不被覆盖，新水印也只绘制一次"""
+    first = str(tmp_path / 'first.pdf')
+    second = str(tmp_path / 'second.pdf')
+    single = str(tmp_path / 'single.pdf')
+    assert tool.add_watermark_to_pdf(sample_pdf, first, 'first', 24, **options)
+    assert tool.add_watermark_to_pdf(first, second, 'second', 48, **options)
+    assert tool.add_watermark_to_pdf(sample_pdf, single, 'second', 48, **options)
+
+    original = text_operations(sample_pdf)
+    expected = text_operations(first) + text_operations(single) - original
+    assert text_operations(second) == expected
+
+
+@pytest.mark.parametrize('options', [{}, {'stream': True}, {'incremental': True}])
+def test_mmap_output_over_input(tmp_path, sample_pdf, options):
+    """内存映射读取时输出到输入文件本身，不能截断仍在读取的输入"""
+    from watermark_tool import WatermarkTool
+
+    tool = WatermarkTool(progress=lambda event: None, mmap_input=True)
+    assert tool.add_watermark_to_pdf(sample_pdf, sample_pdf, 'in place', 24, **options)
+    assert len(PdfReader(sample_pdf).pages) == 3
+    assert not (tmp_path / 'sample.pdf.tmp').exists()
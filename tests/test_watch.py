@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""监视模式"""
+
+import json
+import os
+import shutil
+
+from PIL import Image
+
+
+def test_pdf_next_to_same_named_folder(tmp_path, tool, sample_pdf):
+    """与图片文件夹同名的PDF输出到同一文件，记为冲突失败，不覆盖文件夹的输出"""
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    (input_dir / 'scans').mkdir(parents=True)
+    Image.new('RGB', (200, 300), 'white').save(input_dir / 'scans' / '001.png')
+    shutil.copy(sample_pdf, input_dir / 'scans.pdf')
+    shutil.copy(sample_pdf, input_dir / 'other.pdf')
+
+    assert not tool.watch(str(input_dir), str(output_dir), settle=0, interval=0.1, once=True)
+
+    with open(output_dir / 'watch_status.json', encoding='utf-8') as f:
+        files = json.load(f)['files']
+    assert files['scans']['status'] == 'done'
+    assert files['scans']['pages'] == 1
+    assert files['other.pdf']['status'] == 'done'
+    assert files['scans.pdf']['status'] == 'failed'
+    assert 'scans' in files['scans.pdf']['error']
+    assert os.path.exists(output_dir / 'other.pdf')
+
+    # 输入没有变化时不再重复处理
+    assert tool.watch(str(input_dir), str(output_dir), settle=0, interval=0.1, once=True)
+    with open(output_dir / 'watch_status.json', encoding='utf-8') as f:
+        assert json.load(f)['files'] == files
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""两个Web应用共用的处理接口"""
+
+import importlib
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+
+@pytest.fixture(params=['web_watermark_app', 'app'])
+def client(request):
+    return importlib.import_module(request.param).app.test_client()
+
+
+def test_stream_process(client, sample_pdf):
+    """stream=1 时直接返回带水印的PDF"""
+    with open(sample_pdf, 'rb') as f:
+        response = client.post('/process', data={'mode': 'pdf', 'stream': '1', 'file': (f, 'sample.pdf')})
+    assert response.status_code == 200
+    assert len(PdfReader(io.BytesIO(response.data)).pages) == 3
+
+
+def test_job_lifecycle(client, sample_pdf):
+    """提交任务后可查询状态并下载结果，任务不存在时返回404"""
+    with open(sample_pdf, 'rb') as f:
+        response = client.post('/process', data={'mode': 'pdf', 'file': (f, 'sample.pdf')})
+    assert response.status_code == 202
+    job = response.json
+    assert b'event: done' in client.get(job['progressUrl']).data  # 读到任务结束为止
+    assert client.get(job['statusUrl']).json['status'] == 'done'
+    assert len(PdfReader(io.BytesIO(client.get(job['downloadUrl']).data)).pages) == 3
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/cache').status_code == 200
+
+
+def test_vercel_default_text(sample_pdf):
+    """Vercel版未指定水印文字时使用英文默认水印"""
+    client = importlib.import_module('app').app.test_client()
+    with open(sample_pdf, 'rb') as f:
+        response = client.post('/process', data={'mode': 'pdf', 'stream': '1', 'file': (f, 'sample.pdf')})
+    assert 'PENYANG TUTOR INTERNAL USE' in PdfReader(io.BytesIO(response.data)).pages[0].extract_text()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF水印工具 - 上传文件缓冲
+功能：
+1. 小文件保存在内存中，超过阈值后转存到临时文件
+2. 接收数据的同时计算SHA-256，并粗略嗅探PDF页数，上传结束后不需要再读一遍文件
+3. 保存到任务目录时直接改名（已转存到磁盘的文件不再复制）
+"""
+
+import io
+import os
+import re
+import hashlib
+import tempfile
+from flask import Request, current_app
+
+# PDF页面对象（不含 /Pages 页面树节点）
+PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+COUNT_PATTERN = re.compile(rb'/Count\s+(\d+)')
+LINEARIZED_PATTERN = re.compile(rb'/Linearized\b.*?/N\s+(\d+)', re.S)
+# 跨数据块匹配时保留的尾部字节数
+SNIFF_OVERLAP = 64
+
+
+class UploadSpool:
+    """边接收边计算摘要的上传缓冲
+
+    作为 werkzeug 解析 multipart 请求时的文件流使用：数据写入时更新SHA-256，
+    并统计页面树 /Count 和页面对象数，得到页数估计（压缩在对象流中的页面无法统计）。
+    """
+
+    def __init__(self, max_memory=1024 * 1024, spool_dir=None):
+        self.max_memory = max_memory
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.header = b''
+        self._digest = hashlib.sha256()
+        self._file = io.BytesIO()
+        self._path = None
+        self._tail = b''
+        self._page_objects = 0
+        self._max_count = 0
+
+    @property
+    def in_memory(self):
+        """数据是否仍在内存中"""
+        return self._path is None
+
+    @property
+    def sha256(self):
+        """已接收内容的SHA-256"""
+        return self._digest.hexdigest()
+
+    @property
+    def is_pdf(self):
+        """文件头是否为PDF"""
+        return self.header.startswith(b'%PDF-')
+
+    @property
+    def page_count(self):
+        """嗅探到的页数估计，无法判断时为None"""
+        if not self.is_pdf:
+            return None
+        match = LINEARIZED_PATTERN.search(self.header)
+        if match:
+            return int(match.group(1))
+        # 页面树根节点的 /Count 即总页数（增量更新后的旧版本页面对象仍在文件中，统计页面对象会重复计数），
+        # 没有 /Count（如页面树压缩在对象流中）时才按页面对象数估计
+        return self._max_count or self._page_objects or None
+
+    def _sniff(self, data):
+        if len(self.header) < 1024:
+            self.header += data[:1024 - len(self.header)]
+        window = self._tail + data
+        start = len(self._tail)
+        for match in PAGE_PATTERN.finditer(window):
+            if match.end() > start:
+                self._page_objects += 1
+        for match in COUNT_PATTERN.finditer(window):
+            if match.end() > start:
+                self._max_count = max(self._max_count, int(match.group(1)))
+        self._tail = window[-SNIFF_OVERLAP:]
+
+    def write(self, data):
+        self._digest.update(data)
+        self._sniff(data)
+        self.size += len(data)
+        if self.in_memory and self.size > self.max_memory:
+            # 超过阈值，转存到有名字的临时文件，保存时可以直接改名
+            fd, self._path = tempfile.mkstemp(prefix='watermark_upload_', dir=self.spool_dir)
+            spooled = os.fdopen(fd, 'w+b')
+            spooled.write(self._file.getvalue())
+            self._file = spooled
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def save(self, path):
+        """保存到 path：内存中的数据直接写出，已转存的临时文件直接改名"""
+        if self.in_memory:
+            with open(path, 'wb') as f:
+                f.write(self._file.getvalue())
+            return
+        self._file.close()
+        try:
+            os.replace(self._path, path)
+        except OSError:
+            # 不在同一文件系统，退回复制
+            with open(self._path, 'rb') as src, open(path, 'wb') as dst:
+                while True:
+                    chunk = src.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            os.remove(self._path)
+        self._path = None
+        self._file = io.BytesIO()
+
+    def close(self):
+        self._file.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.remove(self._path)
+        self._path = None
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+class SpoolingRequest(Request):
+    """上传的文件写入 UploadSpool（内存阈值由 app.config['UPLOAD_SPOOL_MEMORY'] 配置）"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(current_app.config.get('UPLOAD_SPOOL_MEMORY', 1024 * 1024))
@@ -11,9 +11,28 @@ PDF水印工具 - 完整版
 import os
 import re
 import sys
-import glob
-from PIL import Image
+import json
+import hashlib
+import time
+import zlib
+import mmap
+import zipfile
+import shutil
+import tempfile
+import threading
+import contextlib
+import functools
+import signal
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject,
+    NullObject, NumberObject, StreamObject,
+)
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.pdfbase import pdfmetrics
@@ -21,13 +40,1619 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.colors import Color
 import io
 
-class WatermarkTool:
+
+def _resolve_all(obj, seen=None):
+    """递归解析PDF对象中的间接引用，使其缓存在reader中，之后多线程读取不再访问底层流"""
+    if seen is None:
+        seen = set()
+    if hasattr(obj, 'idnum'):
+        key = (obj.idnum, obj.generation)
+        if key in seen:
+            return
+        seen.add(key)
+        obj = obj.get_object()
+    if isinstance(obj, dict):
+        for value in obj.values():
+            _resolve_all(value, seen)
+        if hasattr(obj, 'get_data'):
+            obj.get_data()
+    elif isinstance(obj, list):
+        for value in obj:
+            _resolve_all(value, seen)
+
+
+class OverlayCache:
+    """水印页LRU缓存
+
+    按 (宽, 高, 文字, 字体大小, 透明度, 旋转角度) 缓存已生成并解析好的水印页，
+    同一尺寸的页面只生成一次水印。进程内共享，可跨多个 WatermarkTool 实例复用。
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """返回key对应的水印页，不存在时调用factory()生成并放入缓存"""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+
+        page = factory()
+
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._pages.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# 进程级共享的水印页缓存（Web应用中跨请求复用）
+shared_overlay_cache = OverlayCache()
+# 栅格水印蒙版缓存：每个蒙版与整页图片一样大，只保留少量
+shared_raster_cache = OverlayCache(maxsize=4)
+
+
+class ResultCache:
+    """按内容寻址的处理结果磁盘缓存
+
+    键为输入内容的SHA-256加上所有影响输出的参数，值为输出PDF文件。
+    以文件修改时间记录最近使用时间，总大小超过 max_bytes 时删除最久未使用的结果。
+    多个进程可共用同一缓存目录（写入先写临时文件再原子改名）。
+    """
+
+    # 输出格式变化时递增，使旧结果失效
+    VERSION = 1
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def make_key(cls, input_digest, params):
+        """由输入内容摘要和参数字典生成缓存键"""
+        text = json.dumps(
+            {'version': cls.VERSION, 'input': input_digest, 'params': params},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pdf')
+
+    def get(self, key):
+        """返回缓存结果的文件路径并标记为最近使用，不存在时返回None"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, output_path):
+        """把输出文件复制到缓存中，并按大小上限淘汰最久未使用的结果"""
+        temp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, self._path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+
+    def _entries(self):
+        """缓存中的结果文件列表 [(最近使用时间, 大小, 路径)]"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """删除最久未使用的结果，直到总大小不超过上限"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        """命中/未命中次数、结果数量和总大小"""
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+
+def _hash_file(digest, source):
+    """把文件（路径或二进制文件对象）内容加入摘要"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return _hash_file(digest, f)
+    for chunk in iter(lambda: source.read(1024 * 1024), b''):
+        digest.update(chunk)
+
+
+class FontRegistry:
+    """中文字体注册表
+
+    每个进程只查找并注册一次中文字体（TTC解析开销较大），所有 WatermarkTool 实例共享。
+    字体路径可以是字体文件或字体目录，也可通过环境变量 WATERMARK_FONT 指定。
+    """
+
+    FONT_NAME = 'ChineseFont'
+    FALLBACK_FONT = 'Helvetica'
+    FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+    # 没有中文字体时栅格水印使用的英文字体（Pillow按名称在系统字体目录中查找）
+    PIL_FALLBACK_FONTS = ('DejaVuSans.ttf', '/System/Library/Fonts/Helvetica.ttc', 'arial.ttf')
+
+    # 按顺序探测的系统字体（macOS / Linux）
+    SYSTEM_FONTS = [
+        '/System/Library/Fonts/STHeiti Light.ttc',
+        '/System/Library/Fonts/PingFang.ttc',
+        '/System/Library/Fonts/Hiragino Sans GB.ttc',
+        '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+        '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+        '/usr/share/fonts/wqy-microhei/wqy-microhei.ttc',
+        '/usr/share/fonts/wqy-zenhei/wqy-zenhei.ttc',
+        '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
+        '/usr/share/fonts/truetype/arphic/uming.ttc',
+    ]
+
+    def __init__(self, font_path=None):
+        self.font_path = font_path
+        self.loaded_path = None
+        self._font_name = None
+        self._lock = threading.Lock()
+
+    def configure(self, font_path):
+        """指定字体文件或字体目录，下次使用时重新加载"""
+        with self._lock:
+            self.font_path = font_path
+            self.loaded_path = None
+            self._font_name = None
+
+    def candidates(self):
+        """按优先级列出候选字体文件"""
+        paths = []
+        if self.font_path:
+            if os.path.isdir(self.font_path):
+                for root, _, files in os.walk(self.font_path):
+                    for name in sorted(files):
+                        if name.lower().endswith(self.FONT_EXTENSIONS):
+                            paths.append(os.path.join(root, name))
+            else:
+                paths.append(self.font_path)
+        paths.extend(self.SYSTEM_FONTS)
+        return paths
+
+    def get_font_name(self):
+        """返回可用的字体名，首次调用时加载字体"""
+        if self._font_name is not None:
+            return self._font_name
+
+        with self._lock:
+            if self._font_name is None:
+                font_name = self.FALLBACK_FONT
+                for font_path in self.candidates():
+                    if not os.path.exists(font_path):
+                        continue
+                    try:
+                        pdfmetrics.registerFont(TTFont(self.FONT_NAME, font_path))
+                    except Exception:
+                        # 不支持的字体（如CFF轮廓的OTF）跳过
+                        continue
+                    font_name = self.FONT_NAME
+                    self.loaded_path = font_path
+                    break
+                if font_name == self.FALLBACK_FONT:
+                    print("⚠️  未找到可用的中文字体，水印将使用英文文字")
+                self._font_name = font_name
+            return self._font_name
+
+    def get_pil_font(self, size):
+        """返回同一字体的 Pillow 字体对象（栅格水印用），没有中文字体时使用英文字体"""
+        self.get_font_name()
+        paths = [self.loaded_path] if self.loaded_path else []
+        for path in paths + list(self.PIL_FALLBACK_FONTS):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+        return ImageFont.load_default()
+
+
+def _overlay_content(watermark_page):
+    """返回水印页解码后的内容流"""
+    return watermark_page.get_contents().get_data()
+
+
+class FormXObjectStamper:
+    """以共享 Form XObject 方式添加水印
+
+    每种水印只写入一次 Form XObject，各页面仅追加一个引用它的 Do 指令，
+    避免 merge_page 把水印绘制指令和字体资源复制到每一页。
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._forms = {}
+        self._suffixes = {}
+        # 所有页面共用的 q 前缀，隔离原页面内容的图形状态
+        self._prefix = self._add_stream(b"q\n")
+
+    def _add_stream(self, data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self.writer._add_object(stream)
+
+    def _get_form(self, watermark_page):
+        """返回水印的 (名称, Form XObject引用)（首次使用时写入 Form XObject）"""
+        key = id(watermark_page)
+        if key not in self._forms:
+            name = f"/PWWatermark{len(self._forms)}"
+            content = DecodedStreamObject()
+            content.set_data(_overlay_content(watermark_page))
+            form = content.flate_encode()
+            form.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([
+                    NumberObject(0), NumberObject(0),
+                    watermark_page.mediabox[2], watermark_page.mediabox[3],
+                ]),
+                NameObject("/Resources"): watermark_page["/Resources"].clone(self.writer),
+            })
+            form_ref = self.writer._add_object(form)
+            # 保存 watermark_page 引用，防止 id 被复用
+            self._forms[key] = (name, form_ref, watermark_page)
+        return self._forms[key][:2]
+
+    def _suffix(self, name):
+        """返回绘制名为 name 的 Form XObject 的后缀流引用（每个名称只写一次）"""
+        if name not in self._suffixes:
+            self._suffixes[name] = self._add_stream(f"\nQ q {name} Do Q\n".encode())
+        return self._suffixes[name]
+
+    def stamp(self, page, watermark_page):
+        """为已加入 writer 的页面添加水印引用"""
+        name, form_ref = self._get_form(watermark_page)
+        _reference_form(page, name, form_ref, self._prefix, self._suffix)
+
+
+def _reference_form(page, name, form_ref, prefix, suffix_for):
+    """在页面资源中登记 Form XObject，并用 前缀流(q) + 原内容 + 后缀流(Q ... Do) 替换页面内容
+
+    页面资源中已有同名对象（如页面带有本工具以前添加的水印）时在名称后加序号，不覆盖原有对象；
+    suffix_for(名称) 返回绘制该名称的后缀流引用。
+    """
+    resources = page.get("/Resources")
+    resources = DictionaryObject(resources.get_object()) if resources is not None else DictionaryObject()
+    xobjects = resources.get("/XObject")
+    xobjects = DictionaryObject(xobjects.get_object()) if xobjects is not None else DictionaryObject()
+    base_name, index = name, 0
+    while name in xobjects:
+        index += 1
+        name = f"{base_name}_{index}"
+    xobjects[NameObject(name)] = form_ref
+    suffix = suffix_for(name)
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    contents = ArrayObject([prefix])
+    original = page.get("/Contents")
+    if original is not None:
+        if isinstance(original.get_object(), ArrayObject):
+            contents.extend(original.get_object())
+        else:
+            contents.append(original)
+    contents.append(suffix)
+    page[NameObject("/Contents")] = contents
+
+
+def _pdf_number(value):
+    """格式化PDF数值（整数不带小数点）"""
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.4f}".rstrip('0')
+
+
+class StreamingPdfBuilder:
+    """逐页写出的PDF生成器
+
+    每加入一页就把图片流、内容流和页面对象直接写入输出文件，并立即释放，
+    内存占用只取决于当前这一页；页面树、目录和交叉引用表在 close() 时写出。
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    PDF_VERSION = b"1.4"
+
+    def __init__(self, output, append=False):
+        self._own_file = isinstance(output, (str, bytes, os.PathLike))
+        self.file = open(output, 'ab' if append else 'wb') if self._own_file else output
+        self.offsets = {}
+        self.generations = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.bytes_written = self.file.tell() if append else 0
+        self._imported = {}
+        self._forms = {}
+        self._prefix = None
+        self._form_names = {}
+        self._suffixes = {}
+        if not append:
+            self._write(b"%%PDF-%s\n%%\xe2\xe3\xcf\xd3\n" % self.PDF_VERSION)
+
+    def _write(self, data):
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+    def reserve_id(self):
+        """预留一个对象编号"""
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def write_object(self, body, obj_id=None, generation=0):
+        """写出一个对象，body 为对象内容字节串，返回对象编号"""
+        if obj_id is None:
+            obj_id = self.reserve_id()
+        self.offsets[obj_id] = self.bytes_written
+        self.generations[obj_id] = generation
+        self._write(b"%d %d obj\n" % (obj_id, generation) + body + b"\nendobj\n")
+        return obj_id
+
+    def write_stream(self, entries, data, obj_id=None):
+        """写出一个流对象，entries 为字典内容（不含 /Length）"""
+        if obj_id is None:
+            obj_id = self.reserve_id()
+        self.offsets[obj_id] = self.bytes_written
+        self._write(b"%d 0 obj\n<< %s /Length %d >>\nstream\n" % (obj_id, entries, len(data)))
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+        return obj_id
+
+    def import_object(self, obj):
+        """把PyPDF2对象写入本文件：间接引用的对象重新编号后写出，返回可直接序列化的对象"""
+        if isinstance(obj, IndirectObject) and obj.pdf is None:
+            # 已是本文件中的对象
+            return obj
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key not in self._imported:
+                obj_id = self.reserve_id()
+                self._imported[key] = (obj_id, obj.pdf)
+                target = self.import_object(obj.get_object())
+                buffer = io.BytesIO()
+                target.write_to_stream(buffer, None)
+                self.write_object(buffer.getvalue(), obj_id)
+            return IndirectObject(self._imported[key][0], 0, None)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            copy.update({key: self.import_object(value) for key, value in obj.items()})
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self.import_object(value) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.import_object(value) for value in obj])
+        return obj
+
+    def add_watermark_form(self, watermark_page):
+        """把水印页写成 Form XObject（每种水印只写一次），返回对象编号"""
+        key = id(watermark_page)
+        if key not in self._forms:
+            resources = self.import_object(watermark_page["/Resources"])
+            buffer = io.BytesIO()
+            resources.write_to_stream(buffer, None)
+            form_id = self.write_stream(
+                b"/Type /XObject /Subtype /Form /BBox [0 0 %s %s] /Resources %s /Filter /FlateDecode"
+                % (_pdf_number(watermark_page.mediabox[2]).encode(),
+                   _pdf_number(watermark_page.mediabox[3]).encode(),
+                   buffer.getvalue()),
+                zlib.compress(_overlay_content(watermark_page))
+            )
+            # 保存 watermark_page 引用，防止 id 被复用
+            self._forms[key] = (form_id, watermark_page)
+        return self._forms[key][0]
+
+    def watermark_suffix(self, name):
+        """返回绘制名为 name 的 Form XObject 的后缀流引用（每个名称只写一次）"""
+        if name not in self._suffixes:
+            self._suffixes[name] = IndirectObject(self.write_stream(b"", f"\nQ q {name} Do Q\n".encode()), 0, None)
+        return self._suffixes[name]
+
+    def watermark_streams(self, watermark_page):
+        """返回 _reference_form 所需的 (名称, 水印Form XObject引用, q前缀流引用, 后缀流生成函数)，首次使用时写出"""
+        if self._prefix is None:
+            # 所有页面共用的 q 前缀，隔离原页面内容的图形状态
+            self._prefix = IndirectObject(self.write_stream(b"", b"q\n"), 0, None)
+        form_id = self.add_watermark_form(watermark_page)
+        if form_id not in self._form_names:
+            self._form_names[form_id] = f"/PWWatermark{len(self._form_names)}"
+        return self._form_names[form_id], IndirectObject(form_id, 0, None), self._prefix, self.watermark_suffix
+
+    def reserve_pages(self, pages):
+        """预先为已有PDF的页面分配对象编号
+
+        注释等对象中指向页面的引用会直接使用这些编号，不会把页面（连同整个页面树）提前写出。
+        """
+        for page in pages:
+            reference = page.indirect_reference
+            key = (id(reference.pdf), reference.idnum)
+            if key not in self._imported:
+                self._imported[key] = (self.reserve_id(), reference.pdf)
+
+    def add_pdf_page(self, page, watermark_page=None):
+        """加入一页已有PDF的页面（引用的对象重新编号后写出），可同时以共享 Form XObject 叠加水印"""
+        reference = page.indirect_reference
+        key = (id(reference.pdf), reference.idnum)
+        if key not in self._imported:
+            self._imported[key] = (self.reserve_id(), reference.pdf)
+        page_id = self._imported[key][0]
+
+        updated = DictionaryObject(page)
+        updated.pop("/Parent", None)
+        if watermark_page is not None:
+            _reference_form(updated, *self.watermark_streams(watermark_page))
+        updated = self.import_object(updated)
+        updated[NameObject("/Parent")] = IndirectObject(self.PAGES_ID, 0, None)
+        self.write_object(_serialize(updated), page_id)
+        self.page_ids.append(page_id)
+        return page_id
+
+    def add_image_page(self, width, height, data, colorspace, filter_name,
+                       page_width=None, page_height=None, watermark_page=None):
+        """加入一页整页图片，data 为已编码的图片数据；可同时叠加水印"""
+        if page_width is None:
+            page_width, page_height = width, height
+        image_id = self.write_stream(
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace /%s /BitsPerComponent 8 /Filter /%s"
+            % (width, height, colorspace.encode(), filter_name.encode()),
+            data
+        )
+        pw, ph = _pdf_number(page_width).encode(), _pdf_number(page_height).encode()
+        xobjects = b"/Im0 %d 0 R" % image_id
+        content = b"q %s 0 0 %s 0 0 cm /Im0 Do Q" % (pw, ph)
+        if watermark_page is not None:
+            xobjects += b" /Wm0 %d 0 R" % self.add_watermark_form(watermark_page)
+            content += b" q /Wm0 Do Q"
+        content_id = self.write_stream(b"", content)
+        page_id = self.write_object(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] "
+            b"/Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+            % (self.PAGES_ID, pw, ph, xobjects, content_id)
+        )
+        self.page_ids.append(page_id)
+        return page_id
+
+    @staticmethod
+    def jpeg_colorspace(image):
+        """判断已打开（仅读取了文件头）的图片能否直接嵌入原始JPEG数据
+
+        只接受8位的RGB/灰度JPEG，返回对应的PDF颜色空间；CMYK等其他情况返回None，需解码后重新编码。
+        """
+        if image.format != 'JPEG' or getattr(image, 'bits', 8) != 8:
+            return None
+        return {'RGB': 'DeviceRGB', 'L': 'DeviceGray'}.get(image.mode)
+
+    @staticmethod
+    def encode_image(image, quality=None):
+        """把Pillow图片编码为JPEG（默认质量与Pillow保存PDF时一致），返回 (宽, 高, 数据, 颜色空间)
+
+        CMYK图片也转换为RGB：Pillow写出的是反相的Adobe CMYK JPEG，按 /DeviceCMYK 嵌入时颜色会反转。
+        """
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        colorspace = 'DeviceRGB' if image.mode == 'RGB' else 'DeviceGray'
+        buffer = io.BytesIO()
+        if quality is None:
+            image.save(buffer, 'JPEG')
+        else:
+            image.save(buffer, 'JPEG', quality=quality)
+        return image.width, image.height, buffer.getvalue(), colorspace
+
+    @staticmethod
+    def encode_image_lossless(image):
+        """把Pillow图片按原像素以 Flate 压缩（无损），返回 (宽, 高, 数据, 颜色空间)"""
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('L' if image.mode in ('1', 'LA', 'I', 'I;16', 'F') else 'RGB')
+        colorspace = 'DeviceGray' if image.mode == 'L' else 'DeviceRGB'
+        return image.width, image.height, zlib.compress(image.tobytes()), colorspace
+
+    def add_image(self, image, watermark_page=None):
+        """加入一页Pillow图片"""
+        width, height, data, colorspace = self.encode_image(image)
+        return self.add_image_page(
+            width, height, data, colorspace, 'DCTDecode', watermark_page=watermark_page
+        )
+
+    def close(self):
+        """写出页面树、目录、交叉引用表并关闭文件"""
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        self.write_object(
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)),
+            self.PAGES_ID
+        )
+        self.write_object(b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES_ID, self.CATALOG_ID)
+
+        xref_offset = self.bytes_written
+        size = self.next_id
+        lines = [b"xref\n0 %d\n" % size, b"0000000000 65535 f \n"]
+        for obj_id in range(1, size):
+            if obj_id in self.offsets:
+                lines.append(b"%010d 00000 n \n" % self.offsets[obj_id])
+            else:
+                lines.append(b"0000000000 65535 f \n")
+        self._write(b"".join(lines))
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (size, self.CATALOG_ID, xref_offset)
+        )
+        if self._own_file:
+            self.file.close()
+
+    def abort(self):
+        """出错时放弃输出：不写页面树和交叉引用表，关闭并删除自己打开的输出文件
+
+        写入网络响应等对象时只停止写入，由调用方向读取方报告错误。
+        """
+        if self._own_file:
+            self.file.close()
+            try:
+                os.remove(self.file.name)
+            except FileNotFoundError:
+                pass
+
+
+def _find_startxref(path):
+    """读取PDF末尾的 startxref，返回 (交叉引用段偏移, 是否为交叉引用流)"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 2048, 0))
+        tail = f.read()
+        # 已有增量更新时末尾有多个 startxref，取最后一个（最新的交叉引用段）
+        matches = re.findall(rb'startxref\s+(\d+)\s+%%EOF', tail)
+        if not matches:
+            raise ValueError("找不到 startxref")
+        offset = int(matches[-1])
+        f.seek(offset)
+        return offset, not f.read(4).startswith(b'xref')
+
+
+def _serialize(obj):
+    """把PyPDF2对象序列化为字节串"""
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+class IncrementalPdfUpdater(StreamingPdfBuilder):
+    """增量更新方式添加水印
+
+    原文件字节原样复制，只在末尾追加水印 Form XObject、修改过的页面对象和新的交叉引用段，
+    写出时间取决于页数而不是文件大小。
+    """
+
+    def __init__(self, input_pdf, output_pdf, reader):
+        self.prev_xref, self.xref_stream = _find_startxref(input_pdf)
+        shutil.copyfile(input_pdf, output_pdf)
+        super().__init__(output_pdf, append=True)
+        self.trailer = reader.trailer
+        # 交叉引用流的 trailer 中可能没有 /Size，取已知最大对象编号
+        known_ids = [idnum for entries in reader.xref.values() for idnum in entries]
+        known_ids.extend(reader.xref_objStm)
+        self.next_id = max([int(reader.trailer.get('/Size', 0))] + [idnum + 1 for idnum in known_ids])
+        self._write(b"\n")
+
+    def stamp(self, page, watermark_page):
+        """追加引用水印的新版本页面对象（沿用原对象编号）"""
+        updated = DictionaryObject(page)
+        _reference_form(updated, *self.watermark_streams(watermark_page))
+        reference = page.indirect_reference
+        self.write_object(_serialize(updated), reference.idnum, reference.generation)
+
+    def close(self):
+        """追加交叉引用段（与原文件相同的表或流格式）和指向上一段的 trailer"""
+        trailer = DictionaryObject()
+        for key in ('/Root', '/Info', '/ID'):
+            if key in self.trailer:
+                trailer[NameObject(key)] = self.trailer.raw_get(key)
+        trailer[NameObject('/Prev')] = NumberObject(self.prev_xref)
+
+        if self.xref_stream:
+            xref_id = self.reserve_id()
+            xref_offset = self.bytes_written
+            self.offsets[xref_id] = xref_offset
+        else:
+            xref_offset = self.bytes_written
+        trailer[NameObject('/Size')] = NumberObject(self.next_id)
+
+        # 按连续对象编号分组为子段
+        sections = []
+        for obj_id in sorted(self.offsets):
+            if sections and sections[-1][-1] == obj_id - 1:
+                sections[-1].append(obj_id)
+            else:
+                sections.append([obj_id])
+
+        if self.xref_stream:
+            width = max(4, (max(self.offsets.values()).bit_length() + 7) // 8)
+            rows = b"".join(
+                b"\x01" + self.offsets[obj_id].to_bytes(width, 'big')
+                + self.generations.get(obj_id, 0).to_bytes(2, 'big')
+                for section in sections for obj_id in section
+            )
+            index = " ".join(f"{section[0]} {len(section)}" for section in sections)
+            # trailer 条目直接放进交叉引用流的字典（去掉外层 << >>）
+            trailer_bytes = _serialize(trailer)[2:-2]
+            self.write_stream(
+                b"/Type /XRef /W [1 %d 2] /Index [%s] %s" % (width, index.encode(), trailer_bytes),
+                rows, xref_id
+            )
+        else:
+            lines = [b"xref\n"]
+            for section in sections:
+                lines.append(b"%d %d\n" % (section[0], len(section)))
+                for obj_id in section:
+                    lines.append(b"%010d %05d n \n" % (self.offsets[obj_id], self.generations.get(obj_id, 0)))
+            self._write(b"".join(lines))
+            self._write(b"trailer\n" + _serialize(trailer) + b"\n")
+
+        self._write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+        self.file.close()
+
+
+class PdfCompactor(StreamingPdfBuilder):
+    """输出优化：重写整个PDF以减小文件
+
+    1. 合并内容完全相同的对象（包括各页资源字典中重复的直接字体、图形状态字典，先提升为独立对象再合并）
+    2. 未压缩的流（如合并水印后的页面内容流）用 Flate 压缩
+    3. 非流对象打包进压缩的对象流，交叉引用表改为压缩的交叉引用流（PDF 1.5）
+    页面、目录、注释等与位置有关的对象不参与合并。
+    """
+
+    PDF_VERSION = b"1.5"
+    OBJECTS_PER_STREAM = 200
+    # 合并相同对象时迭代细分的最大轮数，超过仍未稳定则不合并
+    MAX_ROUNDS = 32
+    # 其中的直接字典提升为独立对象参与合并的资源类别
+    RESOURCE_CATEGORIES = ('/Font', '/ExtGState', '/ColorSpace', '/Pattern', '/Shading', '/Properties')
+    PINNED_TYPES = ('/Catalog', '/Pages', '/Page')
+
+    def __init__(self, reader, output):
+        if reader.is_encrypted:
+            raise ValueError("加密PDF不支持输出优化")
+        super().__init__(output)
+        self.reader = reader
+        self.nodes = {}
+        self.order = []
+        self.compressed = {}
+        self.objects_before = 0
+        self.objects_merged = 0
+        self.streams_compressed = 0
+        self._queue = deque()
+        self._seen = set()
+        self._next_key = -1
+        self._pending = []
+
+    def _strip(self, obj, context=(None, None)):
+        """复制对象结构：间接引用改为只记录编号并加入读取队列；资源类别字典中的直接字典提升为独立对象
+
+        context 为到达该对象的最后两级字典键，用于识别 /Resources 下的资源类别字典。
+        """
+        if isinstance(obj, IndirectObject):
+            if obj.idnum not in self._seen:
+                self._seen.add(obj.idnum)
+                self._queue.append((obj, context))
+            return IndirectObject(obj.idnum, 0, None)
+        if isinstance(obj, DictionaryObject):
+            hoist = context[0] == '/Resources' and context[1] in self.RESOURCE_CATEGORIES
+            stripped = DictionaryObject()
+            for key, value in obj.items():
+                value = self._strip(value, (context[1], key))
+                if hoist and type(value) is DictionaryObject:
+                    key_id = self._next_key
+                    self._next_key -= 1
+                    self.nodes[key_id] = value
+                    self.order.append(key_id)
+                    value = IndirectObject(key_id, 0, None)
+                stripped[key] = value
+            return stripped
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._strip(value, context) for value in obj])
+        return obj
+
+    def collect(self):
+        """从 trailer 的 /Root、/Info 出发读取所有可达对象，流只保留字典和数据摘要"""
+        self.trailer = self._strip(
+            DictionaryObject({NameObject(key): self.reader.trailer.raw_get(key)
+                              for key in ('/Root', '/Info', '/ID') if key in self.reader.trailer})
+        )
+        while self._queue:
+            reference, context = self._queue.popleft()
+            obj = self.reader.get_object(reference)
+            if isinstance(obj, StreamObject):
+                entries = self._strip(DictionaryObject(obj), context)
+                node = (entries, hashlib.sha256(obj._data).digest(), reference)
+                # 流数据写出时再读取，不在内存中保留
+                self.reader.resolved_objects.pop((reference.generation, reference.idnum), None)
+            else:
+                node = self._strip(obj, context) if obj is not None else NullObject()
+            self.nodes[reference.idnum] = node
+            self.order.append(reference.idnum)
+        self.objects_before = len(self.order)
+
+    def _pinned(self, node):
+        return isinstance(node, DictionaryObject) and (
+            '/Parent' in node or '/Rect' in node or node.get('/Type') in self.PINNED_TYPES
+        )
+
+    def _signature(self, obj, classes):
+        """对象内容的字节表示，引用以被引用对象当前所属的类代替"""
+        if isinstance(obj, tuple):
+            entries, digest, _ = obj
+            return b"S" + self._signature(entries, classes) + digest
+        if isinstance(obj, IndirectObject):
+            return b"R%d" % classes[obj.idnum]
+        if isinstance(obj, DictionaryObject):
+            return b"<<" + b" ".join(
+                key.encode('utf-8') + b" " + self._signature(value, classes)
+                for key, value in sorted(obj.items())
+            ) + b">>"
+        if isinstance(obj, ArrayObject):
+            return b"[" + b" ".join(self._signature(value, classes) for value in obj) + b"]"
+        return _serialize(obj)
+
+    def merge_identical(self):
+        """把对象按内容（连同引用的对象内容）划分为等价类，返回 编号 -> 类
+
+        从所有对象同属一类开始，每轮按 (上一轮的类, 内容签名) 细分，类数不再增加时即为结果，
+        引用成环的对象（如互相引用的字典）也能正确判断。
+        """
+        pinned = {key for key in self.order if self._pinned(self.nodes[key])}
+        classes = dict.fromkeys(self.order, 0)
+        count = 1
+        for _ in range(self.MAX_ROUNDS):
+            table = {}
+            refined = {}
+            for key in self.order:
+                if key in pinned:
+                    signature = b"#%d" % key
+                else:
+                    signature = b"%d:" % classes[key] + self._signature(self.nodes[key], classes)
+                refined[key] = table.setdefault(signature, len(table))
+            classes = refined
+            if len(table) == count:
+                return classes
+            count = len(table)
+        return {key: index for index, key in enumerate(self.order)}
+
+    def _remap(self, obj):
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(self.ids[obj.idnum], 0, None)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._remap(value) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._remap(value) for value in obj])
+        return obj
+
+    def _write_stream_node(self, obj_id, node):
+        entries, _, reference = node
+        data = self.reader.get_object(reference)._data
+        self.reader.resolved_objects.pop((reference.generation, reference.idnum), None)
+        entries = self._remap(entries)
+        if '/Filter' not in entries and entries.get('/Type') != '/Metadata':
+            packed = zlib.compress(data, 9)
+            if len(packed) < len(data):
+                data = packed
+                entries[NameObject('/Filter')] = NameObject('/FlateDecode')
+                self.streams_compressed += 1
+        self.write_stream(_serialize(entries)[2:-2], data, obj_id)
+
+    def _flush_object_stream(self):
+        """把待写出的非流对象打包成一个对象流"""
+        if not self._pending:
+            return
+        stream_id = self.reserve_id()
+        header = []
+        offset = 0
+        for index, (obj_id, body) in enumerate(self._pending):
+            header.append(b"%d %d" % (obj_id, offset))
+            offset += len(body) + 1
+            self.compressed[obj_id] = (stream_id, index)
+        header = b" ".join(header) + b"\n"
+        data = header + b"\n".join(body for _, body in self._pending)
+        self.write_stream(
+            b"/Type /ObjStm /N %d /First %d /Filter /FlateDecode" % (len(self._pending), len(header)),
+            zlib.compress(data, 9), stream_id
+        )
+        self._pending = []
+
+    def compact(self):
+        """执行优化并写出文件"""
+        self.collect()
+        classes = self.merge_identical()
+        representatives = {}
+        for key in self.order:
+            representatives.setdefault(classes[key], key)
+        class_ids = {cls: obj_id for obj_id, cls in enumerate(representatives, 1)}
+        self.ids = {key: class_ids[classes[key]] for key in self.order}
+        self.next_id = len(representatives) + 1
+        self.objects_merged = len(self.order) - len(representatives)
+
+        for key in representatives.values():
+            node = self.nodes[key]
+            if isinstance(node, tuple):
+                self._write_stream_node(self.ids[key], node)
+            else:
+                self._pending.append((self.ids[key], _serialize(self._remap(node))))
+                if len(self._pending) >= self.OBJECTS_PER_STREAM:
+                    self._flush_object_stream()
+        self.close()
+
+    def close(self):
+        """写出剩余的对象流和交叉引用流"""
+        self._flush_object_stream()
+        xref_id = self.reserve_id()
+        size = self.next_id
+        xref_offset = self.bytes_written
+        self.offsets[xref_id] = xref_offset
+        width = max(4, (xref_offset.bit_length() + 7) // 8)
+        rows = []
+        for obj_id in range(size):
+            if obj_id in self.offsets:
+                rows.append(b"\x01" + self.offsets[obj_id].to_bytes(width, 'big') + b"\x00\x00")
+            elif obj_id in self.compressed:
+                stream_id, index = self.compressed[obj_id]
+                rows.append(b"\x02" + stream_id.to_bytes(width, 'big') + index.to_bytes(2, 'big'))
+            else:
+                rows.append(b"\x00" + bytes(width) + b"\xff\xff")
+        trailer = self._remap(self.trailer)
+        trailer[NameObject('/Size')] = NumberObject(size)
+        self.write_stream(
+            b"/Type /XRef /W [1 %d 2] %s /Filter /FlateDecode" % (width, _serialize(trailer)[2:-2]),
+            zlib.compress(b"".join(rows)), xref_id
+        )
+        self._write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+        if self._own_file:
+            self.file.close()
+
+
+# 进程级共享的字体注册表
+shared_font_registry = FontRegistry(os.environ.get('WATERMARK_FONT'))
+
+
+class PageSelection:
+    """要添加水印的页码选择
+
+    规格为逗号分隔的若干项，页码从1开始：
+    N（单页）、A-B（范围）、A-（第A页到最后）、-B（第1页到第B页）、first / last（首页/末页，
+    也可作为范围端点，如 10-last）、*（全部页面）。范围和 * 后可加 /K 表示每隔K页取一页，
+    如 */2 为奇数页、2-/2 为偶数页。
+    单页超出总页数、范围起点大于终点或范围内没有任何页面时报错，范围超出部分自动截去。
+    """
+
+    ITEM_PATTERN = re.compile(r'^(?:(\*)|(\w*)\s*(-)\s*(\w*)|(\w+))\s*(?:/\s*(\d+))?$')
+
+    def __init__(self, spec):
+        self.items = []
+        for part in str(spec).split(','):
+            part = part.strip()
+            if part:
+                self.items.append(self._parse_item(part))
+        if not self.items:
+            raise ValueError(f"页码选择为空: {spec!r}")
+
+    @staticmethod
+    def _parse_endpoint(text, default):
+        """端点：正数为第几页，-1 为末页，None 为未给出"""
+        text = text.lower()
+        if not text:
+            return default
+        if text == 'first':
+            return 1
+        if text == 'last':
+            return -1
+        if text.isdigit() and int(text) > 0:
+            return int(text)
+        raise ValueError(f"无效的页码: {text!r}")
+
+    def _parse_item(self, part):
+        """解析一项，返回 (起始页, 结束页, 步长, 是否为单页)"""
+        match = self.ITEM_PATTERN.match(part)
+        if not match:
+            raise ValueError(f"无效的页码选择: {part!r}")
+        star, start, dash, end, single, step = match.groups()
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError(f"无效的步长: {part!r}")
+        if star:
+            return 1, -1, step, False
+        if dash:
+            start, end = self._parse_endpoint(start, 1), self._parse_endpoint(end, -1)
+            if start > end > 0:
+                raise ValueError(f"页码范围的起点大于终点: {part!r}")
+            return start, end, step, False
+        if step != 1:
+            raise ValueError(f"单页不能指定步长: {part!r}")
+        page = self._parse_endpoint(single, None)
+        return page, page, 1, True
+
+    def indices(self, page_count):
+        """按总页数展开为从0开始的页码列表（升序、不重复）"""
+        selected = set()
+        for start, end, step, single in self.items:
+            start = page_count if start == -1 else start
+            if single and not 1 <= start <= page_count:
+                raise ValueError(f"第 {start} 页超出总页数 {page_count}")
+            if end != -1 and start > end:
+                raise ValueError(f"页码范围 {start}-{end} 的起点大于终点")
+            end = page_count if end == -1 else end
+            pages = range(start - 1, min(end, page_count), step)
+            if not pages:
+                raise ValueError(f"页码范围从第 {start} 页开始，超出总页数 {page_count}")
+            selected.update(pages)
+        return sorted(selected)
+
+    def __str__(self):
+        def endpoint(value):
+            return 'last' if value == -1 else str(value)
+        parts = []
+        for start, end, step, single in self.items:
+            text = endpoint(start) if single else f"{endpoint(start)}-{endpoint(end)}"
+            parts.append(text if step == 1 else f"{text}/{step}")
+        return ','.join(parts)
+
+    @classmethod
+    def resolve(cls, pages, page_count):
+        """把 pages 参数展开为从0开始的页码列表，None 表示全部页面
+
+        pages 可以是规格字符串、PageSelection 或从0开始的页码序列。
+        """
+        if pages is None:
+            return list(range(page_count))
+        if isinstance(pages, str):
+            pages = cls(pages)
+        if isinstance(pages, cls):
+            return pages.indices(page_count)
+        selected = sorted(set(pages))
+        if selected and not (0 <= selected[0] and selected[-1] < page_count):
+            raise ValueError(f"页码超出范围 0-{page_count - 1}")
+        return selected
+
+    @classmethod
+    def key(cls, pages):
+        """用于结果缓存键的规范形式"""
+        if pages is None:
+            return None
+        if isinstance(pages, str):
+            pages = cls(pages)
+        if isinstance(pages, cls):
+            return str(pages)
+        return sorted(set(pages))
+
+
+@contextlib.contextmanager
+def open_pdf_input(input_pdf, use_mmap=False):
+    """打开输入PDF供 PdfReader 读取
+
+    use_mmap=True 时把文件只读映射到内存交给 PdfReader，而不是整个读入进程内存：
+    数据由系统页缓存按需载入，多个进程/任务读取同一文件时共享物理内存。
+    """
+    if not use_mmap or not isinstance(input_pdf, (str, os.PathLike)):
+        yield input_pdf
+        return
+    with open(input_pdf, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+def _watermark_shard(tool_class, font_path, mmap_input, input_pdf, shard_pdf, start, end,
+                     watermark_text, font_size, xobject, selected=None):
+    """子进程：为第 start 到 end-1 页添加水印并写出分片PDF（selected 见 watermark_pages），返回 (页数, 统计数据)
+
+    xobject=True 时分片只复制页面，共享 Form XObject 由父进程拼接时统一写入一次。
+    """
+    tool = tool_class()
+    if tool.font_registry.font_path != font_path:
+        tool.font_registry.configure(font_path)
+
+    with open_pdf_input(input_pdf, mmap_input) as source:
+        with tool.stats.stage('parse'):
+            reader = PdfReader(source)
+        writer = PdfWriter()
+        if xobject:
+            with tool.stats.stage('merge'):
+                for page_num in range(start, end):
+                    writer.add_page(reader.pages[page_num])
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                tool.watermark_pages(reader, writer, range(start, end), watermark_text, font_size, False, selected)
+        with tool.stats.stage('write'), open(shard_pdf, 'wb') as f:
+            writer.write(f)
+    return end - start, tool.stats.to_dict()
+
+
+class ProcessStats:
+    """一次处理的分阶段耗时与计数
+
+    阶段: parse(读取输入PDF) / overlay(生成水印) / merge(合并水印) / decode(图片解码编码) / write(写出) /
+    compact(输出优化)。
+    布尔值等于处理是否成功，因此 process_* 的返回值仍可直接用于 if 判断。
+    """
+
+    STAGES = ('parse', 'overlay', 'merge', 'decode', 'write', 'compact')
+    COUNTERS = (
+        'pages', 'pages_copied', 'overlay_cache_hits', 'overlay_cache_misses', 'result_cache_hits',
+        'result_cache_misses', 'bytes_written',
+    )
+
+    def __init__(self, operation=None, **details):
+        self.operation = operation
+        self.details = details
+        self.success = False
+        self.elapsed = 0.0
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return self.success
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """统计一段代码的耗时（线程池中各线程的耗时累加）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[name] += elapsed
+
+    def count(self, name, value=1):
+        """累加计数"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        """合并另一份统计（如子进程返回的 to_dict() 结果）"""
+        with self._lock:
+            for name, value in other['stages'].items():
+                self.timings[name] = self.timings.get(name, 0.0) + value
+            for name, value in other['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, success):
+        """结束统计并记录总耗时"""
+        self.success = success
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            **{key: value if isinstance(value, (str, int, float, type(None))) else repr(value)
+               for key, value in self.details.items()},
+            'success': self.success,
+            'elapsed': round(self.elapsed, 6),
+            'stages': {name: round(value, 6) for name, value in self.timings.items()},
+            'counters': dict(self.counters),
+        }
+
+    def emit(self, path):
+        """以JSON行追加写入文件，path 为 '-' 时输出到屏幕"""
+        line = json.dumps(self.to_dict(), ensure_ascii=False)
+        if path == '-':
+            print(line)
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def print_progress(event):
+    """默认的进度回调：打印事件中的文字信息"""
+    if event['message'] is not None:
+        print(event['message'])
+
+
+class ProgressChannel:
+    """线程安全的进度通道
+
+    作为 WatermarkTool 的 progress 回调接收事件，只保留最新一条；
+    其他线程（如Web应用的SSE响应）用 wait() 等待更新，处理较慢的读取方自然只看到最新进度。
+    """
+
     def __init__(self):
+        self.event = None
+        self.version = 0
+        self.finished = False
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def __call__(self, event):
+        with self._cond:
+            self.event = event
+            self.version += 1
+            self.updated = time.monotonic()
+            self._cond.notify_all()
+
+    def finish(self, event=None):
+        """标记处理结束（event 为最后一条事件）"""
+        with self._cond:
+            if event is not None:
+                self.event = event
+                self.version += 1
+            self.finished = True
+            self.updated = time.monotonic()
+            self._cond.notify_all()
+
+    def idle_seconds(self):
+        """距最近一次更新的秒数"""
+        return time.monotonic() - self.updated
+
+    def wait(self, version, timeout=None):
+        """等待比 version 新的事件或处理结束，返回 (版本号, 最新事件, 是否结束)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version or self.finished, timeout)
+            return self.version, self.event, self.finished
+
+
+# 文件夹模式支持的图片格式（扩展名不区分大小写）
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+# 文件夹模式写入PDF的图片格式：jpeg（DCTDecode）或 png（无损，FlateDecode）
+IMAGE_FORMATS = ('jpeg', 'png')
+# 监视模式忽略的传输中临时文件
+WATCH_IGNORED_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download')
+# 监视模式中工作进程异常退出时，同一文件最多尝试的次数
+WATCH_MAX_ATTEMPTS = 3
+
+# 编码好的一页图片：图片像素尺寸和数据、页面尺寸（点），以及原图字节数和原分辨率（未知时为None）
+PreparedImage = namedtuple(
+    'PreparedImage',
+    'width height data colorspace filter_name page_width page_height source_bytes source_dpi dpi'
+)
+
+
+def _source_size(source):
+    """图片来源（路径或二进制文件对象）的字节数"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def _image_dpi(img, default=None):
+    """图片自带的分辨率（取横纵中较小者），没有或明显无效时返回 default"""
+    dpi = img.info.get('dpi')
+    if dpi:
+        dpi = min(float(value) for value in dpi)
+        if dpi >= 2:
+            return dpi
+    return default
+
+
+class FragmentCache:
+    """文件夹模式的逐页片段缓存
+
+    每张图片解码、缩放、编码后的结果（PDF图片流的数据和尺寸）保存为一个片段文件，以图片内容的SHA-256加上
+    影响编码的参数为键。清单 manifest.json 记录每个图片文件的路径、大小、修改时间和内容摘要，
+    大小和修改时间都没变的文件不再读取计算摘要。重新生成PDF时只处理新增或修改过的图片，其余页面直接使用片段。
+    每个图片文件夹应使用单独的片段目录：save() 时删除本次没有用到的片段和清单记录。
+    """
+
+    # 片段格式或编码方式变化时递增，使旧片段失效
+    VERSION = 2
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._used = set()
+        self._seen = set()
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(os.path.join(cache_dir, self.MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        self.files = manifest.get('files', {}) if manifest.get('version') == self.VERSION else {}
+
+    def _path(self, fragment_id):
+        return os.path.join(self.cache_dir, fragment_id + '.frag')
+
+    def content_digest(self, source):
+        """图片内容的SHA-256，返回 (摘要, 交给解码器的来源)
+
+        文件路径按清单中的大小和修改时间判断是否需要重新计算；返回文件对象的函数读取一次，
+        读到的数据同时交给解码器，不重复读取。
+        """
+        if isinstance(source, (str, os.PathLike)):
+            key = os.path.abspath(source)
+            stat = os.stat(source)
+            with self._lock:
+                self._seen.add(key)
+                entry = self.files.get(key)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                return entry['sha256'], source
+            digest = hashlib.sha256()
+            _hash_file(digest, source)
+            with self._lock:
+                self.files[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+            return digest.hexdigest(), source
+        data = source()
+        data = data.read() if hasattr(data, 'read') else data
+        return hashlib.sha256(data).hexdigest(), lambda: io.BytesIO(data)
+
+    def get(self, fragment_id):
+        """读取片段，不存在时返回None"""
+        try:
+            with open(self._path(fragment_id), 'rb') as f:
+                header = json.loads(f.readline())
+                data = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        return PreparedImage(data=data, **header)
+
+    def put(self, fragment_id, image):
+        """保存片段（先写临时文件再原子改名）"""
+        header = image._asdict()
+        del header['data']
+        temp_path = self._path(fragment_id) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                f.write(image.data)
+            os.replace(temp_path, self._path(fragment_id))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def prepare(self, prepare, params, source):
+        """返回图片的 PreparedImage：有片段时直接读取，否则调用 prepare(source) 生成并保存片段"""
+        digest, source = self.content_digest(source)
+        fragment_id = hashlib.sha256(
+            json.dumps({'version': self.VERSION, 'input': digest, 'params': params},
+                       sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest()
+        with self._lock:
+            self._used.add(fragment_id)
+        image = self.get(fragment_id)
+        with self._lock:
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if image is None:
+            image = prepare(source)
+            self.put(fragment_id, image)
+        return image
+
+    def save(self):
+        """写出清单，删除本次没有用到的片段和已不存在的图片记录"""
+        with self._lock:
+            self.files = {key: entry for key, entry in self.files.items() if key in self._seen}
+            manifest = {'version': self.VERSION, 'files': self.files}
+        temp_path = os.path.join(self.cache_dir, self.MANIFEST + f".{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(self.cache_dir, self.MANIFEST))
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.frag') and entry.name[:-len('.frag')] not in self._used:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def _watch_signature(path):
+    """监视模式中输入的签名：文件为 [大小, 修改时间]，图片文件夹为 [文件数, 总大小, 最新修改时间]（纳秒）"""
+    if os.path.isdir(path):
+        stats = [entry.stat() for entry in os.scandir(path) if entry.is_file()]
+        return [len(stats), sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)]
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class WatchState:
+    """监视模式的逐文件状态记录
+
+    输出目录下的 watch_status.json 以输入的相对路径为键，记录状态（queued / running / done / failed）、
+    输入签名（见 _watch_signature）、输出路径、页数、开始/结束时间和错误信息，每次状态变化后原子地重写。
+    进程重启后，已完成（或已失败）且输入签名没有变化的文件不再处理；重启前处于 queued / running 的文件重新排队。
+    """
+
+    VERSION = 1
+    FILENAME = 'watch_status.json'
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, self.FILENAME)
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        self.files = state.get('files', {}) if state.get('version') == self.VERSION else {}
+
+    def get(self, name):
+        return self.files.get(name, {})
+
+    def update(self, name, **fields):
+        """更新一个文件的记录并立即写出"""
+        self.files.setdefault(name, {}).update(fields)
+        self.save()
+
+    def is_finished(self, name, signature, output_path):
+        """输入没有变化，且已成功处理（输出仍在）或已失败"""
+        entry = self.files.get(name)
+        if entry is None or entry.get('signature') != signature:
+            return False
+        if entry['status'] == 'done':
+            return os.path.exists(output_path)
+        return entry['status'] == 'failed'
+
+    def prune(self, names):
+        """删除输入已不存在的文件的记录"""
+        removed = [name for name in self.files if name not in names]
+        for name in removed:
+            del self.files[name]
+        if removed:
+            self.save()
+
+    def save(self):
+        temp_path = self.path + f".{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'files': self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
+
+
+def _is_zip_source(source):
+    """判断图片来源是否为ZIP文件（路径或二进制文件对象）"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.isfile(source) and zipfile.is_zipfile(source)
+    return hasattr(source, 'read') and hasattr(source, 'seek') and zipfile.is_zipfile(source)
+
+
+# 批量模式工作进程内常驻的工具实例（字体与水印缓存在处理多个文件时保持热状态）
+_batch_tool = None
+
+
+def _init_batch_worker(tool_class, font_path, mmap_input=False, compact_output=False):
+    """批量模式工作进程初始化：创建工具实例并预先加载字体"""
+    global _batch_tool
+    _batch_tool = tool_class(mmap_input=mmap_input, compact_output=compact_output)
+    if _batch_tool.font_registry.font_path != font_path:
+        _batch_tool.font_registry.configure(font_path)
+    _batch_tool.font_registry.get_font_name()
+
+
+def _batch_process_file(input_pdf, output_pdf, watermark_text, font_size, xobject, pages=None):
+    """批量模式工作进程：处理单个PDF，返回 (页数, 统计数据)"""
+    _batch_tool.stats = ProcessStats()
+    with contextlib.redirect_stdout(io.StringIO()):
+        page_count = _batch_tool.watermark_file(input_pdf, output_pdf, watermark_text, font_size, xobject, pages)
+    return page_count, _batch_tool.stats.to_dict()
+
+
+def _watch_process_job(kind, input_path, output_path, watermark_text, font_size, xobject, pages):
+    """监视模式工作进程：处理一个PDF或图片文件夹/ZIP并原子地写出，返回 (页数, 统计数据)"""
+    if kind == 'pdf':
+        return _batch_process_file(input_path, output_path, watermark_text, font_size, xobject, pages)
+    
+    # process_folder_to_pdf 出错时只报告不抛出，收集报告的信息作为错误原因
+    messages = []
+    progress = _batch_tool.progress
+    _batch_tool.progress = lambda event: event['message'] and messages.append(event['message'])
+    temp_pdf = output_path + '.tmp'
+    try:
+        stats = _batch_tool.process_folder_to_pdf(input_path, temp_pdf, watermark_text, font_size)
+        if not stats:
+            errors = [message.strip() for message in messages if '❌' in message]
+            raise RuntimeError(errors[-1] if errors else '图片转PDF失败')
+        os.replace(temp_pdf, output_path)
+    finally:
+        _batch_tool.progress = progress
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+    return stats.counters['pages'], stats.to_dict()
+
+
+class WatermarkTool:
+    def __init__(self, overlay_cache=None, font_registry=None, stats_log=None, progress=None,
+                 result_cache=None, mmap_input=False, compact_output=False):
         self.default_watermark_text = "朋阳托辅内部专用资料"
         self.default_font_size = 32
         self.default_opacity = 0.35
         self.default_rotation = 45
+        self.overlay_cache = overlay_cache if overlay_cache is not None else shared_overlay_cache
+        self.raster_cache = shared_raster_cache
+        self.font_registry = font_registry if font_registry is not None else shared_font_registry
+        # 最近一次处理的统计；stats_log 指定时每次 process_* 结束后以JSON行写入该文件（'-' 为屏幕）
+        self.stats = ProcessStats()
+        self.stats_log = stats_log
+        # 进度回调，接收 report() 生成的事件字典；默认打印文字信息
+        self.progress = progress if progress is not None else print_progress
+        # 处理结果缓存（ResultCache），相同输入和参数直接复用已有输出
+        self.result_cache = result_cache
+        # 以内存映射方式读取输入PDF（见 open_pdf_input）
+        self.mmap_input = mmap_input
+        # 写出后再做一遍输出优化（见 PdfCompactor），减小下载体积
+        self.compact_output = compact_output
         
+    def begin_stats(self, operation, **details):
+        """开始一次处理的统计"""
+        self.stats = ProcessStats(operation, **details)
+        return self.stats
+
+    def finish_stats(self, success):
+        """结束统计，按需写出JSON行，返回统计对象（布尔值为是否成功）"""
+        self.stats.finish(success)
+        if self.stats_log:
+            self.stats.emit(self.stats_log)
+        return self.stats
+
+    def report(self, message=None, done=None, total=None):
+        """报告进度
+
+        事件字典包含 operation、message（可为None，表示只更新进度）、done/total（已完成/总页数或文件数）、
+        elapsed（本次处理已用秒数）和 eta（按当前速度估算的剩余秒数，无法估算时为None）。
+        """
+        elapsed = time.perf_counter() - self.stats.started
+        eta = None
+        if done and total:
+            eta = elapsed / done * (total - done)
+        self.progress({
+            'operation': self.stats.operation,
+            'message': message,
+            'done': done,
+            'total': total,
+            'elapsed': round(elapsed, 3),
+            'eta': None if eta is None else round(eta, 1),
+        })
+
+    def input_digest(self, source):
+        """输入内容的SHA-256：PDF/ZIP文件按字节计算，图片文件夹按排序后的文件名和内容计算"""
+        digest = hashlib.sha256()
+        if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+            for name, path in self.list_images(source):
+                digest.update(name.encode('utf-8') + b'\0')
+                _hash_file(digest, path)
+        else:
+            _hash_file(digest, source)
+        return digest.hexdigest()
+
+    def result_cache_key(self, mode, input_path, input_digest=None, **params):
+        """结果缓存键：输入内容加上所有影响输出的参数（含水印样式和实际使用的字体）
+
+        input_digest 为已算好的输入摘要（如上传时边接收边计算），省去再读一遍输入。
+        """
+        params.update(
+            mode=mode,
+            opacity=self.default_opacity,
+            rotation=self.default_rotation,
+            font=self.watermark_font(),
+            compact=self.compact_output,
+            tool=f"{type(self).__module__}.{type(self).__qualname__}",
+        )
+        if input_digest is None:
+            input_digest = self.input_digest(input_path)
+        return ResultCache.make_key(input_digest, params)
+
+    def use_cached_result(self, cache_key, output):
+        """命中结果缓存时把结果复制到 output（路径或可写对象）并返回True"""
+        path = self.result_cache.get(cache_key)
+        if path is None:
+            self.stats.count('result_cache_misses')
+            return False
+        try:
+            with self.stats.stage('write'), open(path, 'rb') as cached:
+                if isinstance(output, (str, os.PathLike)):
+                    with open(output, 'wb') as f:
+                        shutil.copyfileobj(cached, f)
+                else:
+                    shutil.copyfileobj(cached, output)
+                size = cached.tell()
+        except FileNotFoundError:
+            # 刚好被其他进程淘汰
+            self.stats.count('result_cache_misses')
+            return False
+        self.stats.count('result_cache_hits')
+        self.stats.count('bytes_written', size)
+        self.report("♻️  命中结果缓存，直接使用已有的处理结果")
+        return True
+
+    def store_result(self, cache_key, output):
+        """把输出文件存入结果缓存（流式输出到可写对象时不缓存）"""
+        if cache_key is not None and isinstance(output, (str, os.PathLike)):
+            self.result_cache.put(cache_key, output)
+
+    def compact_file(self, path):
+        """对已写出的PDF做输出优化，结果更小时替换原文件，返回 (优化前大小, 优化后大小)"""
+        before = os.path.getsize(path)
+        temp_path = path + '.compact.tmp'
+        try:
+            with self.stats.stage('compact'):
+                with open_pdf_input(path, self.mmap_input) as source:
+                    compactor = PdfCompactor(PdfReader(source), temp_path)
+                    compactor.compact()
+            after = os.path.getsize(temp_path)
+            if after < before:
+                os.replace(temp_path, path)
+            else:
+                after = before
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.stats.count('compact_bytes_before', before)
+        self.stats.count('compact_bytes_after', after)
+        self.stats.count('objects_merged', compactor.objects_merged)
+        self.stats.count('streams_compressed', compactor.streams_compressed)
+        self.report(
+            f"🗜️  输出优化: {before / 1024 / 1024:.2f} MB → {after / 1024 / 1024:.2f} MB "
+            f"(减少 {(before - after) / before * 100 if before else 0:.1f}%)，"
+            f"合并相同对象 {compactor.objects_merged} 个，压缩流 {compactor.streams_compressed} 个"
+        )
+        return before, after
+
+    def compact_result(self, output):
+        """开启输出优化时优化输出文件；输出到可写对象（流式响应）时无法优化，优化失败时保留原输出"""
+        if not self.compact_output:
+            return
+        if not isinstance(output, (str, os.PathLike)):
+            self.report("⚠️  流式输出不做输出优化")
+            return
+        try:
+            self.compact_file(output)
+        except Exception as e:
+            self.report(f"⚠️  输出优化失败，保留未优化的输出: {e}")
+
     def extract_page_number(self, filename):
         """从文件名中提取页码数字"""
         match = re.search(r'页面_(\d+)', filename)
@@ -35,81 +1660,271 @@ class WatermarkTool:
             return int(match.group(1))
         return 0
 
-    def create_pdf_from_images(self, image_folder, output_pdf):
-        """将图片按页码顺序合并成PDF"""
-        print(f"正在扫描图片文件夹: {image_folder}")
-        
-        # 支持的图片格式
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff']
-        image_files = []
+    def list_images(self, image_source):
+        """列出图片并按页码排序，返回 [(名称, 来源)]
+
+        image_source 可以是图片文件夹、已打开的 zipfile.ZipFile，或 (名称, 数据) 的可迭代对象，
+        数据为 bytes、二进制文件对象或文件路径。来源为文件路径或返回二进制文件对象的函数。
+        """
+        if isinstance(image_source, (str, os.PathLike)):
+            entries = [(entry.name, entry.path) for entry in os.scandir(image_source) if entry.is_file()]
+        elif isinstance(image_source, zipfile.ZipFile):
+            # 多个解码线程共用同一个ZIP文件，读取成员时加锁
+            lock = threading.Lock()
+            
+            def member(info):
+                def read():
+                    with lock:
+                        return io.BytesIO(image_source.read(info))
+                return read
+            
+            entries = [
+                (info.filename, member(info)) for info in image_source.infolist()
+                if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+            ]
+        else:
+            entries = []
+            for name, data in image_source:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    entries.append((name, lambda data=data: io.BytesIO(data)))
+                elif hasattr(data, 'read'):
+                    entries.append((name, lambda data=data: data))
+                else:
+                    entries.append((name, data))
         
-        for ext in image_extensions:
-            image_files.extend(glob.glob(os.path.join(image_folder, ext)))
-            image_files.extend(glob.glob(os.path.join(image_folder, ext.upper())))
+        entries = [entry for entry in entries if os.path.splitext(entry[0])[1].lower() in IMAGE_EXTENSIONS]
+        entries.sort(key=lambda entry: self.extract_page_number(os.path.basename(entry[0])))
+        return entries
+
+    def prepare_image(self, source, jpeg_passthrough=True, target_dpi=None, image_format=None,
+                      jpeg_quality=None, source_dpi=None, raster_watermark=None):
+        """读取并编码一张图片，返回 PreparedImage，可在线程池中并行执行
+
+        source 为文件路径或返回二进制文件对象的函数。
+        target_dpi 指定时把分辨率高于它的图片缩小到该分辨率，页面大小不变；原分辨率取图片自带的DPI，
+        没有时使用 source_dpi（也没有则不缩小）。JPEG以 draft 模式按 1/2、1/4、1/8 直接解码出较小的图像，
+        不解码随后要丢弃的像素。image_format 为 'jpeg'（默认）或 'png'（无损），jpeg_quality 为JPEG质量。
+        raster_watermark 为 (水印文字, 字体大小) 时把水印直接烧进像素（见 get_raster_watermark）。
+        """
+        if callable(source):
+            source = source()
+        with self.stats.stage('decode'), Image.open(source) as img:
+            source_bytes = _source_size(source)
+            page_width, page_height = img.size
+            dpi = _image_dpi(img, source_dpi)
+            scale = 1.0
+            if target_dpi and dpi and dpi > target_dpi:
+                scale = target_dpi / dpi
+            reencode = (scale < 1 or image_format == 'png' or jpeg_quality is not None
+                        or raster_watermark is not None)
+            colorspace = StreamingPdfBuilder.jpeg_colorspace(img) if jpeg_passthrough else None
+            
+            def passthrough():
+                if isinstance(source, (str, os.PathLike)):
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                else:
+                    source.seek(0)
+                    data = source.read()
+                return PreparedImage(
+                    img.width, img.height, data, colorspace, 'DCTDecode',
+                    page_width, page_height, source_bytes, dpi, dpi
+                )
+            
+            if colorspace is not None and not reencode:
+                # JPEG直接嵌入，只读取了文件头
+                return passthrough()
+            
+            if scale < 1:
+                size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                # 只对JPEG有效：解码器直接输出不小于 size 的缩小图像
+                img.draft(None, size)
+                img = img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+            if raster_watermark is not None:
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                mask = self.get_raster_watermark(img.width, img.height, page_width, page_height, *raster_watermark)
+                # 黑色水印按蒙版混合：Pillow在C代码中一次完成整张图片，不逐像素在Python中计算
+                img.paste(0 if img.mode == 'L' else (0, 0, 0), mask=mask)
+            if image_format == 'png':
+                width, height, data, pdf_colorspace = StreamingPdfBuilder.encode_image_lossless(img)
+                filter_name = 'FlateDecode'
+            else:
+                if image_format is None and jpeg_quality is None and img.mode != 'RGB':
+                    img = img.convert('RGB')
+                width, height, data, pdf_colorspace = StreamingPdfBuilder.encode_image(img, jpeg_quality)
+                filter_name = 'DCTDecode'
+            if (scale == 1 and colorspace is not None and filter_name == 'DCTDecode'
+                    and raster_watermark is None and len(data) >= source_bytes):
+                # 只是换了编码参数却没有变小，保留原JPEG
+                return passthrough()
+            return PreparedImage(
+                width, height, data, pdf_colorspace, filter_name,
+                page_width, page_height, source_bytes, dpi, dpi * scale if dpi else None
+            )
+
+    def create_pdf_from_images(self, image_folder, output_pdf, watermark_text=None, font_size=None,
+                               jpeg_passthrough=True, decode_workers=None, prefetch=None,
+                               target_dpi=None, image_format=None, jpeg_quality=None, source_dpi=None,
+                               raster=False, fragment_cache=None):
+        """将图片按页码顺序合并成PDF
+
+        image_folder 可以是图片文件夹、ZIP文件（路径、二进制文件对象或 zipfile.ZipFile），
+        或 (名称, 数据) 的可迭代对象；ZIP中的图片直接读入解码器，不解压到磁盘。
+        指定 watermark_text 时在生成每一页的同时叠加水印，一次写出最终文件。
+        jpeg_passthrough=True 时JPEG图片直接嵌入原始数据（DCTDecode），不解码也不重新压缩。
+        图片由 decode_workers 个线程提前解码编码，最多预读 prefetch 页，写出仍按页码顺序。
+        target_dpi、image_format、jpeg_quality、source_dpi 控制降低分辨率和重新压缩（见 prepare_image），
+        指定任一项时报告每页和总共节省的字节数。
+        raster=True 时水印烧进图片像素（无法从PDF中删除），而不是叠加矢量文字。
+        fragment_cache（FragmentCache）指定时只处理新增或修改过的图片，其余页面使用已缓存的片段。
+        """
+        if image_format not in (None,) + IMAGE_FORMATS:
+            self.report(f"错误：不支持的图片格式 {image_format}，请使用 {' 或 '.join(IMAGE_FORMATS)}")
+            return False
+        with contextlib.ExitStack() as stack:
+            if _is_zip_source(image_folder):
+                image_folder = stack.enter_context(zipfile.ZipFile(image_folder))
+            raster_watermark = None
+            if raster and watermark_text is not None:
+                raster_watermark = (watermark_text, font_size)
+                watermark_text = None
+            prepare = functools.partial(
+                self.prepare_image, jpeg_passthrough=jpeg_passthrough, target_dpi=target_dpi,
+                image_format=image_format, jpeg_quality=jpeg_quality, source_dpi=source_dpi,
+                raster_watermark=raster_watermark
+            )
+            if fragment_cache is not None:
+                # 片段只取决于图片内容和影响编码的参数（矢量水印在写出时叠加，不影响片段）
+                params = {
+                    'jpeg_passthrough': jpeg_passthrough, 'target_dpi': target_dpi, 'image_format': image_format,
+                    'jpeg_quality': jpeg_quality, 'source_dpi': source_dpi, 'raster': raster_watermark and [
+                        *raster_watermark, self.default_opacity, self.default_rotation, *self.watermark_font(),
+                    ],
+                }
+                prepare = functools.partial(fragment_cache.prepare, prepare, params)
+            if not self._create_pdf_from_images(
+                image_folder, output_pdf, watermark_text, font_size, decode_workers, prefetch, prepare,
+                any(value is not None for value in (target_dpi, image_format, jpeg_quality))
+            ):
+                return False
+            if fragment_cache is not None:
+                fragment_cache.save()
+                self.stats.count('fragment_cache_hits', fragment_cache.hits)
+                self.stats.count('fragment_cache_misses', fragment_cache.misses)
+                self.report(f"🧩 片段缓存: 复用 {fragment_cache.hits} 页，新处理 {fragment_cache.misses} 页")
+            return True
+
+    def _create_pdf_from_images(self, image_folder, output_pdf, watermark_text, font_size,
+                                decode_workers, prefetch, prepare, report_savings):
+        if isinstance(image_folder, (str, os.PathLike)):
+            self.report(f"正在扫描图片文件夹: {image_folder}")
+        elif isinstance(image_folder, zipfile.ZipFile):
+            self.report(f"正在读取ZIP中的图片: {image_folder.filename or '上传的文件'}")
         
-        print(f"找到 {len(image_files)} 个图片文件")
+        image_files = self.list_images(image_folder)
+        self.report(f"找到 {len(image_files)} 个图片文件")
         
         if not image_files:
-            print("错误：没有找到图片文件")
+            self.report("错误：没有找到图片文件")
             return False
         
-        # 按页码排序
-        image_files.sort(key=lambda x: self.extract_page_number(os.path.basename(x)))
-        
-        print("开始转换图片为PDF...")
+        self.report("开始转换图片为PDF...")
+        self.report(f"正在保存PDF文件: {output_pdf}")
         
-        # 转换第一张图片
-        first_image = Image.open(image_files[0])
-        if first_image.mode != 'RGB':
-            first_image = first_image.convert('RGB')
+        if decode_workers is None:
+            decode_workers = min(4, os.cpu_count() or 1)
+        if prefetch is None:
+            prefetch = decode_workers * 2
         
-        # 准备其他图片
-        other_images = []
-        for i, img_path in enumerate(image_files[1:], 1):
-            if i % 10 == 0:
-                print(f"处理第 {i+1} 张图片...")
-            
-            img = Image.open(img_path)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            other_images.append(img)
-        
-        # 保存为PDF
-        print(f"正在保存PDF文件: {output_pdf}")
-        first_image.save(
-            output_pdf,
-            save_all=True,
-            append_images=other_images,
-            format='PDF'
-        )
+        # 线程池提前解码（Pillow解码时释放GIL），按页码顺序逐页写出并释放，
+        # 内存只占用预读窗口内的页面
+        builder = StreamingPdfBuilder(output_pdf)
+        bytes_in = bytes_out = downsampled = 0
+        try:
+            with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+                pending = deque()
+                remaining = iter(image_files)
+                for name, source in islice(remaining, max(prefetch, 1)):
+                    pending.append((name, pool.submit(prepare, source)))
+                
+                i = 0
+                while pending:
+                    if not report_savings:
+                        self.report(f"处理第 {i+1} 张图片..." if i % 10 == 0 else None, i, len(image_files))
+                    name, future = pending.popleft()
+                    image = future.result()
+                    for next_name, source in islice(remaining, 1):
+                        pending.append((next_name, pool.submit(prepare, source)))
+                    
+                    watermark_page = None
+                    if watermark_text is not None:
+                        watermark_page = self.get_watermark_page(
+                            image.page_width, image.page_height, watermark_text, font_size
+                        )
+                    with self.stats.stage('write'):
+                        builder.add_image_page(
+                            image.width, image.height, image.data, image.colorspace, image.filter_name,
+                            image.page_width, image.page_height, watermark_page=watermark_page
+                        )
+                    self.stats.count('pages')
+                    
+                    bytes_in += image.source_bytes
+                    bytes_out += len(image.data)
+                    if image.width < image.page_width:
+                        downsampled += 1
+                    if report_savings:
+                        resolution = ""
+                        if image.source_dpi and image.dpi != image.source_dpi:
+                            resolution = f" {image.source_dpi:.0f}dpi → {image.dpi:.0f}dpi,"
+                        self.report(
+                            f"第 {i+1} 页 {name}:{resolution} {image.source_bytes / 1024:.0f} KB → "
+                            f"{len(image.data) / 1024:.0f} KB",
+                            i, len(image_files)
+                        )
+                    i += 1
+        except BaseException:
+            builder.abort()
+            raise
+        with self.stats.stage('write'):
+            builder.close()
+        self.stats.count('bytes_written', builder.bytes_written)
+        self.stats.count('image_bytes_in', bytes_in)
+        self.stats.count('image_bytes_out', bytes_out)
+        self.stats.count('images_downsampled', downsampled)
         
-        print(f"✅ PDF创建成功！包含 {len(image_files)} 页")
+        if report_savings and bytes_in:
+            self.report(
+                f"🖼️  图片数据: {bytes_in / 1024 / 1024:.2f} MB → {bytes_out / 1024 / 1024:.2f} MB "
+                f"(节省 {(bytes_in - bytes_out) / bytes_in * 100:.1f}%)，{downsampled} 页降低了分辨率"
+            )
+        self.report(f"✅ PDF创建成功！包含 {len(image_files)} 页", len(image_files), len(image_files))
         return True
 
+    def watermark_layout(self, font_size):
+        """根据字体大小调整布局密度，返回水印的 (行数, 列数)"""
+        if font_size <= 24:
+            return 6, 2  # 小字体，密集布局
+        elif font_size <= 32:
+            return 5, 2  # 中等字体
+        elif font_size <= 40:
+            return 4, 2  # 大字体
+        return 3, 2  # 超大字体，稀疏布局
+
+    def watermark_font(self):
+        """水印实际使用的字体标识 (字体名, 字体文件)，用于水印和结果缓存键
+
+        子类改用其他字体绘制水印时应一并覆盖本方法，避免为了计算缓存键而加载用不到的中文字体。
+        """
+        return self.font_registry.get_font_name(), self.font_registry.loaded_path
+
     def create_watermark_pdf(self, width, height, watermark_text, font_size):
         """创建水印PDF"""
         packet = io.BytesIO()
         c = canvas.Canvas(packet, pagesize=(width, height))
         
-        # 注册中文字体
-        font_name = 'Helvetica'
-        try:
-            chinese_fonts = [
-                '/System/Library/Fonts/STHeiti Light.ttc',
-                '/System/Library/Fonts/PingFang.ttc',
-                '/System/Library/Fonts/Hiragino Sans GB.ttc'
-            ]
-            
-            for font_path in chinese_fonts:
-                if os.path.exists(font_path):
-                    try:
-                        pdfmetrics.registerFont(TTFont('ChineseFont', font_path))
-                        font_name = 'ChineseFont'
-                        break
-                    except:
-                        continue
-        except:
-            pass
+        # 中文字体由进程级字体注册表统一加载
+        font_name = self.font_registry.get_font_name()
         
         # 如果没有中文字体，使用英文替代
         if font_name == 'Helvetica':
@@ -119,16 +1934,7 @@ class WatermarkTool:
         c.setFont(font_name, font_size)
         c.setFillColor(Color(0, 0, 0, alpha=self.default_opacity))
         
-        # 根据字体大小调整布局密度
-        if font_size <= 24:
-            rows, cols = 6, 2  # 小字体，密集布局
-        elif font_size <= 32:
-            rows, cols = 5, 2  # 中等字体
-        elif font_size <= 40:
-            rows, cols = 4, 2  # 大字体
-        else:
-            rows, cols = 3, 2  # 超大字体，稀疏布局
-        
+        rows, cols = self.watermark_layout(font_size)
         row_spacing = height / (rows + 1)
         col_spacing = width / (cols + 1)
         
@@ -150,136 +1956,782 @@ class WatermarkTool:
         packet.seek(0)
         return packet
 
-    def add_watermark_to_pdf(self, input_pdf, output_pdf, watermark_text, font_size):
-        """为PDF添加水印"""
-        try:
-            reader = PdfReader(input_pdf)
-            writer = PdfWriter()
-            
-            print(f"正在为PDF添加水印，总页数: {len(reader.pages)}")
-            print(f"水印设置 - 文字: {watermark_text}, 字体大小: {font_size}px")
-            
-            for page_num, page in enumerate(reader.pages):
-                if page_num % 20 == 0:
-                    print(f"添加水印到第 {page_num + 1} 页...")
-                
-                # 获取页面尺寸
-                page_box = page.mediabox
-                page_width = float(page_box.width)
-                page_height = float(page_box.height)
-                
-                # 创建水印
+    def get_watermark_page(self, width, height, watermark_text, font_size):
+        """获取指定页面尺寸的水印页（优先从缓存读取）"""
+        key = (
+            round(width, 2), round(height, 2), watermark_text, font_size,
+            self.default_opacity, self.default_rotation, *self.watermark_font()
+        )
+
+        built = []
+
+        def build():
+            with self.stats.stage('overlay'):
                 watermark_packet = self.create_watermark_pdf(
-                    page_width, page_height, watermark_text, font_size
+                    width, height, watermark_text, font_size
                 )
-                watermark_reader = PdfReader(watermark_packet)
-                watermark_page = watermark_reader.pages[0]
-                
-                # 合并水印
-                page.merge_page(watermark_page)
-                writer.add_page(page)
+                watermark_page = PdfReader(watermark_packet).pages[0]
+                _resolve_all(watermark_page)
+            built.append(True)
+            return watermark_page
+
+        watermark_page = self.overlay_cache.get(key, build)
+        self.stats.count('overlay_cache_misses' if built else 'overlay_cache_hits')
+        return watermark_page
+
+    def create_raster_watermark(self, width, height, page_width, page_height, watermark_text, font_size):
+        """按 create_watermark_pdf 的布局把水印画成 width×height 像素的蒙版（L模式，值为水印不透明度）
+
+        page_width/page_height 为页面尺寸（点），字体和间距按 像素/点 的比例缩放。
+        """
+        if self.font_registry.get_font_name() == FontRegistry.FALLBACK_FONT:
+            watermark_text = "PENYANG TUTOR INTERNAL USE ONLY"
+        scale = width / page_width
+        font = self.font_registry.get_pil_font(max(1, round(font_size * scale)))
+        
+        # 单个水印文字只画一次并旋转，再按网格位置合成
+        left, top, right, bottom = font.getbbox(watermark_text)
+        label = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(label).text((-left, -top), watermark_text, fill=round(255 * self.default_opacity), font=font)
+        label = label.rotate(self.default_rotation, resample=Image.BICUBIC, expand=True)
+        
+        mask = Image.new('L', (width, height), 0)
+        rows, cols = self.watermark_layout(font_size)
+        row_spacing = page_height / (rows + 1) * scale
+        col_spacing = page_width / (cols + 1) * scale
+        for row in range(rows):
+            for col in range(cols):
+                x = round(col_spacing * (col + 1) - label.width / 2)
+                y = round(row_spacing * (row + 1) - label.height / 2)
+                box = (x, y, x + label.width, y + label.height)
+                # 相邻水印重叠时取较大的不透明度
+                mask.paste(ImageChops.lighter(mask.crop(box), label), box)
+        return mask
+
+    def get_raster_watermark(self, width, height, page_width, page_height, watermark_text, font_size):
+        """获取指定像素尺寸的栅格水印蒙版（优先从缓存读取）"""
+        key = (
+            width, height, round(page_width, 2), round(page_height, 2), watermark_text, font_size,
+            self.default_opacity, self.default_rotation, *self.watermark_font()
+        )
+        
+        built = []
+        
+        def build():
+            with self.stats.stage('overlay'):
+                mask = self.create_raster_watermark(
+                    width, height, page_width, page_height, watermark_text, font_size
+                )
+            built.append(True)
+            return mask
+        
+        mask = self.raster_cache.get(key, build)
+        self.stats.count('overlay_cache_misses' if built else 'overlay_cache_hits')
+        return mask
+
+    def watermark_pages(self, reader, writer, page_numbers, watermark_text, font_size, xobject=False,
+                        selected=None, stamper=None):
+        """把 reader 中指定页码（从0开始）的页面按顺序加入 writer 并添加水印
+
+        selected 为要添加水印的页码集合（None 为全部）；其余页面原样加入，不解析也不改写内容流。
+        stamper 为多次调用间共用的 FormXObjectStamper（xobject=True 时），使同一水印在 writer 中只写入一次。
+        """
+        if xobject and stamper is None:
+            stamper = FormXObjectStamper(writer)
+        elif not xobject:
+            stamper = None
+        
+        for done, page_num in enumerate(page_numbers):
+            page = reader.pages[page_num]
+            if selected is not None and page_num not in selected:
+                with self.stats.stage('merge'):
+                    writer.add_page(page)
+                self.stats.count('pages_copied')
+                continue
+            self.report(
+                f"添加水印到第 {page_num + 1} 页..." if page_num % 20 == 0 else None, done, len(page_numbers)
+            )
             
-            # 保存结果
-            with open(output_pdf, 'wb') as output_file:
-                writer.write(output_file)
+            # 获取页面尺寸
+            page_box = page.mediabox
+            page_width = float(page_box.width)
+            page_height = float(page_box.height)
             
-            print(f"✅ 水印添加完成！")
-            return True
+            # 获取水印（相同尺寸的页面复用缓存）
+            watermark_page = self.get_watermark_page(
+                page_width, page_height, watermark_text, font_size
+            )
             
+            # 合并水印
+            with self.stats.stage('merge'):
+                if stamper is not None:
+                    stamper.stamp(writer.add_page(page), watermark_page)
+                else:
+                    page.merge_page(watermark_page)
+                    writer.add_page(page)
+            self.stats.count('pages')
+
+    def add_watermark_to_pdf(self, input_pdf, output_pdf, watermark_text, font_size, xobject=False,
+                             workers=1, incremental=False, stream=False, pages=None):
+        """为PDF添加水印
+
+        xobject=True 时水印以共享 Form XObject 写入一次，各页只引用它，输出更小。
+        workers>1 时按页码分片交给多个进程并行处理，再按顺序拼接。
+        incremental=True 时以增量更新方式输出：原文件字节不变，只追加水印和修改过的页面。
+        stream=True 时每处理完一页就立即写出（共享 Form XObject 方式），
+        output_pdf 可以是只支持 write() 的对象（如网络响应），不需要等全部页面处理完。
+        pages 指定只为部分页面添加水印（规格字符串、PageSelection 或从0开始的页码序列，见 PageSelection），
+        其余页面原样复制，不解析也不改写内容流；增量更新方式下未选中的页面完全不写出。
+        内存映射输入且输出就是输入文件本身时，先写到临时文件，读取结束后再替换原文件。
+        """
+        temp_pdf = None
+        if (self.mmap_input and isinstance(input_pdf, (str, os.PathLike))
+                and isinstance(output_pdf, (str, os.PathLike)) and os.path.exists(output_pdf)
+                and os.path.samefile(input_pdf, output_pdf)):
+            temp_pdf = os.fspath(output_pdf) + '.tmp'
+        try:
+            with open_pdf_input(input_pdf, self.mmap_input) as source:
+                result = self._add_watermark(
+                    input_pdf, source, temp_pdf or output_pdf, watermark_text, font_size, xobject, workers,
+                    incremental, stream, pages
+                )
+            if temp_pdf:
+                os.replace(temp_pdf, output_pdf)
+            return result
         except Exception as e:
-            print(f"添加水印时出错: {e}")
+            self.report(f"添加水印时出错: {e}")
             return False
+        finally:
+            if temp_pdf and os.path.exists(temp_pdf):
+                os.remove(temp_pdf)
 
-    def process_folder_to_pdf(self, folder_path, output_path, watermark_text=None, font_size=None):
-        """处理文件夹：图片转PDF并添加水印"""
+    def _add_watermark(self, input_pdf, source, output_pdf, watermark_text, font_size, xobject,
+                       workers, incremental, stream, pages=None):
+        """add_watermark_to_pdf 的处理过程，source 为交给 PdfReader 的输入（路径或内存映射）"""
+        with self.stats.stage('parse'):
+            reader = PdfReader(source)
+            page_count = len(reader.pages)
+
+        self.report(f"正在为PDF添加水印，总页数: {page_count}")
+        self.report(f"水印设置 - 文字: {watermark_text}, 字体大小: {font_size}px")
+        selected = None
+        if pages is not None:
+            selected = PageSelection.resolve(pages, page_count)
+            self.report(f"选中 {len(selected)} 页添加水印，其余 {page_count - len(selected)} 页原样复制")
+
+        if incremental:
+            if reader.is_encrypted or not isinstance(input_pdf, str):
+                self.report("⚠️  加密PDF或非文件输入不支持增量更新，改为完整重写")
+            else:
+                self._watermark_incremental(
+                    input_pdf, output_pdf, reader, watermark_text, font_size, selected
+                )
+                self.report(f"✅ 水印添加完成！", page_count, page_count)
+                return True
+
+        if stream:
+            self._watermark_streaming(reader, output_pdf, watermark_text, font_size, selected)
+            self.report(f"✅ 水印添加完成！", page_count, page_count)
+            return True
+
+        if workers > 1 and page_count > 1 and isinstance(input_pdf, str) and (selected is None or len(selected) > 1):
+            writer = self._watermark_parallel(
+                input_pdf, page_count, watermark_text, font_size, xobject, workers, selected
+            )
+        else:
+            writer = PdfWriter()
+            self.watermark_pages(
+                reader, writer, range(page_count), watermark_text, font_size, xobject,
+                set(selected) if selected is not None else None
+            )
+
+        # 保存结果
+        with self.stats.stage('write'), open(output_pdf, 'wb') as output_file:
+            writer.write(output_file)
+        self.stats.count('bytes_written', os.path.getsize(output_pdf))
+
+        self.report(f"✅ 水印添加完成！", page_count, page_count)
+        return True
+
+    def _watermark_incremental(self, input_pdf, output_pdf, reader, watermark_text, font_size, selected=None):
+        """以增量更新方式添加水印，selected 为要添加水印的页码列表（None 为全部）
+
+        增量更新只追加修改过的页面，未选中的页面不需要读取，耗时只与选中的页数有关。
+        """
+        updater = IncrementalPdfUpdater(input_pdf, output_pdf, reader)
+        try:
+            page_numbers = range(len(reader.pages)) if selected is None else selected
+            for done, page_num in enumerate(page_numbers):
+                page = reader.pages[page_num]
+                self.report(
+                    f"添加水印到第 {page_num + 1} 页..." if page_num % 20 == 0 else None, done, len(page_numbers)
+                )
+                watermark_page = self.get_watermark_page(
+                    float(page.mediabox.width), float(page.mediabox.height), watermark_text, font_size
+                )
+                with self.stats.stage('merge'):
+                    updater.stamp(page, watermark_page)
+                self.stats.count('pages')
+        except BaseException:
+            updater.abort()
+            raise
+        with self.stats.stage('write'):
+            updater.close()
+        self.stats.count('bytes_written', updater.bytes_written)
+
+    def _watermark_streaming(self, reader, output_pdf, watermark_text, font_size, selected=None):
+        """逐页添加水印并立即写出，selected 为要添加水印的页码列表（None 为全部），其余页面原样写出"""
+        builder = StreamingPdfBuilder(output_pdf)
+        try:
+            page_count = len(reader.pages)
+            selected = None if selected is None else set(selected)
+            builder.reserve_pages(reader.pages)
+            for page_num, page in enumerate(reader.pages):
+                if selected is not None and page_num not in selected:
+                    with self.stats.stage('write'):
+                        builder.add_pdf_page(page)
+                    reader.resolved_objects.clear()
+                    self.stats.count('pages_copied')
+                    continue
+                self.report(f"添加水印到第 {page_num + 1} 页..." if page_num % 20 == 0 else None, page_num, page_count)
+                watermark_page = self.get_watermark_page(
+                    float(page.mediabox.width), float(page.mediabox.height), watermark_text, font_size
+                )
+                with self.stats.stage('write'):
+                    builder.add_pdf_page(page, watermark_page)
+                # 本页引用的对象都已写出，释放读取器的解析缓存，内存占用只取决于当前页
+                reader.resolved_objects.clear()
+                self.stats.count('pages')
+        except BaseException:
+            # 不写页面树和 trailer，避免留下缺页却看似完整的PDF
+            builder.abort()
+            raise
+        with self.stats.stage('write'):
+            builder.close()
+        self.stats.count('bytes_written', builder.bytes_written)
+
+    def _watermark_parallel(self, input_pdf, page_count, watermark_text, font_size, xobject, workers,
+                            selected=None):
+        """多进程分片添加水印，返回按原页序拼接好的 PdfWriter
+
+        selected 为要添加水印的页码列表（None 为全部）；分片按选中的页数均分，而不是按总页数。
+        xobject=True 时分片只复制页面，拼接时用同一个 FormXObjectStamper 添加水印，每种水印在输出中只写入一次。
+        """
+        if selected is None:
+            workers = min(workers, page_count)
+            bounds = [page_count * i // workers for i in range(workers + 1)]
+        else:
+            workers = min(workers, len(selected))
+            bounds = [0] + [selected[len(selected) * i // workers] for i in range(1, workers)] + [page_count]
+            selected = set(selected)
+        self.report(f"使用 {workers} 个进程并行处理")
+        
+        writer = PdfWriter()
+        stamper = FormXObjectStamper(writer) if xobject else None
+        with tempfile.TemporaryDirectory() as temp_dir, ProcessPoolExecutor(workers) as pool:
+            shard_paths = [os.path.join(temp_dir, f"shard_{i}.pdf") for i in range(workers)]
+            futures = [
+                pool.submit(
+                    _watermark_shard, type(self), self.font_registry.font_path, self.mmap_input, input_pdf,
+                    shard_paths[i], bounds[i], bounds[i + 1], watermark_text, font_size, xobject,
+                    selected and {page for page in selected if bounds[i] <= page < bounds[i + 1]}
+                )
+                for i in range(workers)
+            ]
+            
+            # 按分片顺序拼接，保证页序与串行处理一致
+            for i, future in enumerate(futures):
+                _, stats = future.result()
+                self.stats.merge(stats)
+                self.report(
+                    f"分片 {i + 1}/{workers} 完成 (第 {bounds[i] + 1}-{bounds[i + 1]} 页)", bounds[i + 1], page_count
+                )
+                with self.stats.stage('parse'):
+                    shard = PdfReader(shard_paths[i])
+                if stamper is not None:
+                    shard_selected = None if selected is None else {
+                        page - bounds[i] for page in selected if bounds[i] <= page < bounds[i + 1]
+                    }
+                    # 进度已按分片报告，拼接时不再逐页报告
+                    progress, self.progress = self.progress, lambda event: None
+                    try:
+                        self.watermark_pages(
+                            shard, writer, range(len(shard.pages)), watermark_text, font_size, True,
+                            shard_selected, stamper
+                        )
+                    finally:
+                        self.progress = progress
+                else:
+                    with self.stats.stage('parse'):
+                        for page in shard.pages:
+                            writer.add_page(page)
+        return writer
+
+    def process_folder_to_pdf(self, folder_path, output_path, watermark_text=None, font_size=None,
+                              decode_workers=None, input_digest=None, target_dpi=None, image_format=None,
+                              jpeg_quality=None, source_dpi=None, raster=False, fragment_dir=None):
+        """处理文件夹：图片转PDF并添加水印，返回处理统计（布尔值为是否成功）
+
+        target_dpi、image_format、jpeg_quality、source_dpi 见 prepare_image；raster=True 时水印烧进图片像素。
+        fragment_dir 指定时使用该目录中的逐页片段缓存（见 FragmentCache），只处理新增或修改过的图片。
+        """
         if watermark_text is None:
             watermark_text = self.default_watermark_text
         if font_size is None:
             font_size = self.default_font_size
+        self.begin_stats('folder', input=folder_path, output=output_path)
             
-        print("=" * 70)
-        print("📁 文件夹图片转PDF并添加水印")
-        print("=" * 70)
+        self.report("=" * 70)
+        self.report("📁 文件夹图片转PDF并添加水印")
+        self.report("=" * 70)
         
         # 检查输入文件夹
-        if not os.path.exists(folder_path):
-            print(f"❌ 错误：找不到文件夹 {folder_path}")
-            return False
-        
-        # 生成临时PDF文件名
-        temp_pdf = output_path.replace('.pdf', '_临时.pdf')
+        if isinstance(folder_path, (str, os.PathLike)) and not os.path.exists(folder_path):
+            self.report(f"❌ 错误：找不到文件夹 {folder_path}")
+            return self.finish_stats(False)
         
         try:
-            # 步骤1：图片转PDF
-            print("\n📸 步骤1: 将图片按页码顺序合并为PDF")
-            if not self.create_pdf_from_images(folder_path, temp_pdf):
-                return False
-            
-            # 步骤2：添加水印
-            print(f"\n🏷️  步骤2: 添加水印 (字体大小: {font_size}px)")
-            if not self.add_watermark_to_pdf(temp_pdf, output_path, watermark_text, font_size):
-                return False
+            cache_key = None
+            if self.result_cache is not None:
+                cache_key = self.result_cache_key(
+                    'folder', folder_path, input_digest, watermark_text=watermark_text, font_size=font_size,
+                    target_dpi=target_dpi, image_format=image_format, jpeg_quality=jpeg_quality,
+                    source_dpi=source_dpi, raster=raster
+                )
+                if self.use_cached_result(cache_key, output_path):
+                    self.show_result(output_path, watermark_text, font_size)
+                    return self.finish_stats(True)
             
-            # 步骤3：清理临时文件
-            print("\n🧹 步骤3: 清理临时文件")
-            if os.path.exists(temp_pdf):
-                os.remove(temp_pdf)
-                print("临时文件已删除")
+            # 图片转PDF的同时添加水印，一次写出最终文件
+            self.report(f"\n📸 将图片按页码顺序合并为PDF并添加水印 (字体大小: {font_size}px)")
+            if not self.create_pdf_from_images(
+                folder_path, output_path, watermark_text, font_size, decode_workers=decode_workers,
+                target_dpi=target_dpi, image_format=image_format, jpeg_quality=jpeg_quality, source_dpi=source_dpi,
+                raster=raster, fragment_cache=FragmentCache(fragment_dir) if fragment_dir else None
+            ):
+                return self.finish_stats(False)
+            self.compact_result(output_path)
+            self.store_result(cache_key, output_path)
             
             # 显示结果
             self.show_result(output_path, watermark_text, font_size)
-            return True
+            return self.finish_stats(True)
             
         except Exception as e:
-            print(f"❌ 处理过程中出错: {e}")
-            return False
+            self.report(f"❌ 处理过程中出错: {e}")
+            return self.finish_stats(False)
+
+    def process_pdf_watermark(self, input_pdf, output_pdf, watermark_text=None, font_size=None, xobject=False,
+                              workers=1, incremental=False, stream=False, input_digest=None, pages=None):
+        """处理PDF：为现有PDF添加水印，返回处理统计（布尔值为是否成功）
 
-    def process_pdf_watermark(self, input_pdf, output_pdf, watermark_text=None, font_size=None):
-        """处理PDF：为现有PDF添加水印"""
+        pages 指定只为部分页面添加水印，见 add_watermark_to_pdf。
+        """
         if watermark_text is None:
             watermark_text = self.default_watermark_text
         if font_size is None:
             font_size = self.default_font_size
+        self.begin_stats('pdf', input=input_pdf, output=output_pdf)
             
-        print("=" * 70)
-        print("📄 PDF文件添加水印")
-        print("=" * 70)
+        self.report("=" * 70)
+        self.report("📄 PDF文件添加水印")
+        self.report("=" * 70)
         
         # 检查输入文件
         if not os.path.exists(input_pdf):
-            print(f"❌ 错误：找不到PDF文件 {input_pdf}")
-            return False
+            self.report(f"❌ 错误：找不到PDF文件 {input_pdf}")
+            return self.finish_stats(False)
         
         try:
+            cache_key = None
+            if self.result_cache is not None:
+                # 多进程分片只影响处理速度，不影响输出内容，不计入缓存键
+                cache_key = self.result_cache_key(
+                    'pdf', input_pdf, input_digest, watermark_text=watermark_text, font_size=font_size,
+                    xobject=xobject, incremental=incremental, stream=stream, pages=PageSelection.key(pages)
+                )
+                if self.use_cached_result(cache_key, output_pdf):
+                    self.show_result(output_pdf, watermark_text, font_size)
+                    return self.finish_stats(True)
+            
             # 添加水印
-            print(f"\n🏷️  添加水印 (字体大小: {font_size}px)")
-            if not self.add_watermark_to_pdf(input_pdf, output_pdf, watermark_text, font_size):
-                return False
+            self.report(f"\n🏷️  添加水印 (字体大小: {font_size}px)")
+            if not self.add_watermark_to_pdf(
+                input_pdf, output_pdf, watermark_text, font_size, xobject, workers, incremental, stream, pages
+            ):
+                return self.finish_stats(False)
+            if incremental and self.compact_output:
+                # 输出优化会重写整个文件，增量更新要保证原文件字节不变，因此不做优化
+                self.report("⚠️  增量更新输出不做输出优化，保留原文件字节不变")
+            else:
+                self.compact_result(output_pdf)
+            self.store_result(cache_key, output_pdf)
             
             # 显示结果
             self.show_result(output_pdf, watermark_text, font_size)
-            return True
+            return self.finish_stats(True)
             
         except Exception as e:
-            print(f"❌ 处理过程中出错: {e}")
-            return False
+            self.report(f"❌ 处理过程中出错: {e}")
+            return self.finish_stats(False)
+
+    def watermark_file(self, input_pdf, output_pdf, watermark_text, font_size, xobject=False, pages=None):
+        """为单个PDF添加水印并原子地写出（先写临时文件再改名），返回页数，出错时抛出异常
+
+        pages 指定只为部分页面添加水印，见 add_watermark_to_pdf。
+        """
+        with open_pdf_input(input_pdf, self.mmap_input) as source:
+            with self.stats.stage('parse'):
+                reader = PdfReader(source)
+                page_count = len(reader.pages)
+            selected = None if pages is None else set(PageSelection.resolve(pages, page_count))
+            writer = PdfWriter()
+            self.watermark_pages(reader, writer, range(page_count), watermark_text, font_size, xobject, selected)
+            
+            temp_pdf = output_pdf + '.tmp'
+            try:
+                with self.stats.stage('write'), open(temp_pdf, 'wb') as output_file:
+                    writer.write(output_file)
+                self.stats.count('bytes_written', os.path.getsize(temp_pdf))
+                self.compact_result(temp_pdf)
+                os.replace(temp_pdf, output_pdf)
+            finally:
+                if os.path.exists(temp_pdf):
+                    os.remove(temp_pdf)
+        return page_count
+
+    def find_batch_jobs(self, input_dir, output_dir):
+        """遍历输入目录中的PDF，返回 (待处理任务列表, 已是最新而跳过的数量)
+
+        输出目录镜像输入目录结构；输出文件比输入文件新时跳过。
+        """
+        output_root = os.path.abspath(output_dir)
+        jobs = []
+        skipped = 0
+        for root, dirs, files in os.walk(input_dir):
+            # 输出目录位于输入目录内时不处理输出文件
+            dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_root)
+            for name in sorted(files):
+                if not name.lower().endswith('.pdf'):
+                    continue
+                input_pdf = os.path.join(root, name)
+                output_pdf = os.path.join(output_dir, os.path.relpath(input_pdf, input_dir))
+                if (os.path.exists(output_pdf)
+                        and os.path.getmtime(output_pdf) >= os.path.getmtime(input_pdf)):
+                    skipped += 1
+                    continue
+                jobs.append((input_pdf, output_pdf))
+        return jobs, skipped
+
+    def process_batch(self, input_dir, output_dir, watermark_text=None, font_size=None, xobject=False,
+                      workers=1, pages=None):
+        """批量处理：为目录树中的所有PDF添加水印，输出到镜像目录树，返回处理统计
+
+        pages 为每个文件中要添加水印的页码（见 PageSelection），None 为全部页面。
+        """
+        if watermark_text is None:
+            watermark_text = self.default_watermark_text
+        if font_size is None:
+            font_size = self.default_font_size
+        self.begin_stats('batch', input=input_dir, output=output_dir)
+            
+        self.report("=" * 70)
+        self.report("🗂️  批量PDF添加水印")
+        self.report("=" * 70)
+        
+        if not os.path.isdir(input_dir):
+            self.report(f"❌ 错误：找不到文件夹 {input_dir}")
+            return self.finish_stats(False)
+        
+        jobs, skipped = self.find_batch_jobs(input_dir, output_dir)
+        self.report(f"找到 {len(jobs)} 个待处理PDF，{skipped} 个已是最新（跳过）")
+        for _, output_pdf in jobs:
+            os.makedirs(os.path.dirname(output_pdf) or '.', exist_ok=True)
+        
+        start_time = time.time()
+        total_pages = 0
+        failed = 0
+        
+        def report(index, input_pdf, pages, error):
+            rel_path = os.path.relpath(input_pdf, input_dir)
+            if error is None:
+                self.report(f"[{index}/{len(jobs)}] ✅ {rel_path} ({pages} 页)", index, len(jobs))
+            else:
+                self.report(f"[{index}/{len(jobs)}] ❌ {rel_path}: {error}", index, len(jobs))
+        
+        if workers > 1 and len(jobs) > 1:
+            # 每个工作进程只加载一次字体，水印缓存在它处理的所有文件间复用
+            with ProcessPoolExecutor(
+                workers, initializer=_init_batch_worker,
+                initargs=(type(self), self.font_registry.font_path, self.mmap_input, self.compact_output)
+            ) as pool:
+                futures = {
+                    pool.submit(_batch_process_file, input_pdf, output_pdf,
+                                watermark_text, font_size, xobject, pages): input_pdf
+                    for input_pdf, output_pdf in jobs
+                }
+                for index, future in enumerate(as_completed(futures), 1):
+                    try:
+                        page_count, stats = future.result()
+                        self.stats.merge(stats)
+                        total_pages += page_count
+                        report(index, futures[future], page_count, None)
+                    except Exception as e:
+                        failed += 1
+                        report(index, futures[future], 0, e)
+        else:
+            for index, (input_pdf, output_pdf) in enumerate(jobs, 1):
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        page_count = self.watermark_file(
+                            input_pdf, output_pdf, watermark_text, font_size, xobject, pages
+                        )
+                    total_pages += page_count
+                    report(index, input_pdf, page_count, None)
+                except Exception as e:
+                    failed += 1
+                    report(index, input_pdf, 0, e)
+        
+        elapsed = max(time.time() - start_time, 1e-6)
+        done = len(jobs) - failed
+        self.report("\n" + "=" * 70)
+        self.report("✅ 批量处理完成！")
+        self.report(f"📄 成功: {done} 个，失败: {failed} 个，跳过: {skipped} 个")
+        self.report(f"⏱️  耗时: {elapsed:.2f} 秒")
+        self.report(f"🚀 吞吐量: {done / elapsed:.2f} 文件/秒，{total_pages / elapsed:.1f} 页/秒")
+        self.report("=" * 70)
+        self.stats.details.update(files=done, failed=failed, skipped=skipped)
+        return self.finish_stats(failed == 0)
+
+    def find_watch_jobs(self, input_dir, output_dir):
+        """监视模式：列出输入目录树中可处理的输入，返回 [(相对路径, 类型, 输入路径, 输出路径)]
+
+        类型为 'pdf'（PDF文件）或 'folder'（图片ZIP包，或直接包含图片的子文件夹）；输出目录镜像输入目录结构，
+        图片文件夹和ZIP包输出为同名PDF。隐藏文件和传输中的临时文件（.tmp、.part 等）不处理。
+        与图片文件夹同名的PDF（或ZIP包）和该文件夹输出到同一路径，仍然列出，由 watch 记为冲突失败。
+        """
+        output_root = os.path.abspath(output_dir)
+        jobs = []
+        for root, dirs, files in os.walk(input_dir):
+            dirs[:] = sorted(
+                d for d in dirs
+                if not d.startswith('.') and os.path.abspath(os.path.join(root, d)) != output_root
+            )
+            files = [
+                name for name in sorted(files)
+                if not name.startswith(('.', '~')) and not name.lower().endswith(WATCH_IGNORED_SUFFIXES)
+            ]
+            if os.path.abspath(root) != os.path.abspath(input_dir) and any(
+                    os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS for name in files):
+                rel_path = os.path.relpath(root, input_dir)
+                jobs.append((rel_path, 'folder', root, os.path.join(output_dir, rel_path + '.pdf')))
+            for name in files:
+                base, ext = os.path.splitext(name)
+                if ext.lower() not in ('.pdf', '.zip'):
+                    continue
+                input_path = os.path.join(root, name)
+                rel_path = os.path.relpath(input_path, input_dir)
+                kind = 'pdf' if ext.lower() == '.pdf' else 'folder'
+                output_name = os.path.join(os.path.dirname(rel_path), base + '.pdf')
+                jobs.append((rel_path, kind, input_path, os.path.join(output_dir, output_name)))
+        # 本身是某个任务输出的文件不作为输入，否则水印会反复叠加
+        outputs = {os.path.abspath(job[3]) for job in jobs}
+        return [job for job in jobs if os.path.abspath(job[2]) not in outputs]
+
+    def _watch_pool(self, workers):
+        """监视模式的工作进程池：每个进程只加载一次字体，水印缓存在它处理的所有文件间复用"""
+        return ProcessPoolExecutor(
+            workers, initializer=_init_batch_worker,
+            initargs=(type(self), self.font_registry.font_path, self.mmap_input, self.compact_output)
+        )
+
+    def watch(self, input_dir, output_dir, watermark_text=None, font_size=None, xobject=False, workers=1,
+              pages=None, settle=5.0, interval=2.0, once=False):
+        """监视模式：持续监视输入目录，新放入的PDF、图片文件夹和ZIP包写完后自动添加水印，返回处理统计
+
+        每隔 interval 秒扫描一次输入目录（见 find_watch_jobs），输入的大小和修改时间连续 settle 秒不变才视为已写完，
+        放入队列交给 workers 个常驻工作进程处理。每个文件的状态写入输出目录下的 watch_status.json（见 WatchState），
+        重启后不会重新处理已完成的文件；修改过的输入会重新处理。
+        收到 SIGTERM 时不再接受新文件，等正在处理的文件完成后退出；Ctrl-C 时不再等待，未完成的文件下次启动时重新处理。
+        once=True 时处理完当前已有的文件后退出。
+        """
+        if watermark_text is None:
+            watermark_text = self.default_watermark_text
+        if font_size is None:
+            font_size = self.default_font_size
+        self.begin_stats('watch', input=input_dir, output=output_dir)
+        
+        self.report("=" * 70)
+        self.report("👀 监视文件夹自动添加水印")
+        self.report("=" * 70)
+        
+        if not os.path.isdir(input_dir):
+            self.report(f"❌ 错误：找不到文件夹 {input_dir}")
+            return self.finish_stats(False)
+        input_root, output_root = os.path.realpath(input_dir), os.path.realpath(output_dir)
+        if os.path.commonpath([input_root, output_root]) == output_root:
+            # 输出写进输入目录后会被当作新输入再次处理，水印不断叠加
+            self.report(f"❌ 错误：输出目录不能是输入目录或其上级目录: {output_dir}")
+            return self.finish_stats(False)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        state = WatchState(output_dir)
+        pending = {}        # 相对路径 -> (签名, 签名开始保持不变的时间)
+        queue = deque()     # 已写完、等待处理的任务
+        running = {}        # future -> 任务
+        stop = threading.Event()
+        processed = failed = total_pages = 0
+        
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        
+        def log(message):
+            self.report(f"[{time.strftime('%H:%M:%S')}] {message}", processed + failed, None)
+        
+        def finish(job, page_count=0, stats=None, error=None):
+            nonlocal processed, failed, total_pages
+            name, started = job[0], state.get(job[0]).get('started', time.time())
+            fields = {'finished': time.time(), 'elapsed': round(time.time() - started, 3)}
+            if error is None:
+                processed += 1
+                total_pages += page_count
+                self.stats.merge(stats)
+                state.update(name, status='done', pages=page_count, error=None, **fields)
+                log(f"✅ {name} ({page_count} 页, {fields['elapsed']:.1f} 秒)")
+            else:
+                failed += 1
+                state.update(name, status='failed', error=str(error), **fields)
+                log(f"❌ {name}: {error}")
+        
+        self.report(f"输入目录: {input_dir}")
+        self.report(f"输出目录: {output_dir}")
+        self.report(f"写入稳定时间: {settle} 秒，扫描间隔: {interval} 秒，工作进程: {workers}")
+        pool = self._watch_pool(workers)
+        try:
+            while not stop.is_set():
+                now = time.time()
+                jobs = self.find_watch_jobs(input_dir, output_dir)
+                active = {job[0] for job in queue} | {job[0] for job in running.values()}
+                folder_outputs = {
+                    os.path.abspath(job[3]): job[0] for job in jobs if os.path.isdir(job[2])
+                }
+                for name, kind, input_path, output_path in jobs:
+                    if name in active:
+                        continue
+                    try:
+                        signature = _watch_signature(input_path)
+                    except OSError:
+                        # 扫描后被移走
+                        continue
+                    if state.is_finished(name, signature, output_path):
+                        pending.pop(name, None)
+                        continue
+                    if name not in pending or pending[name][0] != signature:
+                        # 新出现或仍在写入的输入重新计时；不按修改时间判断，复制时保留了修改时间的文件也要等写完
+                        pending[name] = (signature, now)
+                    if now - pending[name][1] < settle:
+                        continue
+                    del pending[name]
+                    state.update(name, status='queued', kind=kind, signature=signature,
+                                 output=os.path.relpath(output_path, output_dir), attempts=0, error=None)
+                    conflict = folder_outputs.get(os.path.abspath(output_path))
+                    if conflict is not None and conflict != name:
+                        # 与同名图片文件夹输出到同一文件，不处理，记为失败
+                        finish((name, kind, input_path, output_path),
+                               error=f"与图片文件夹 {conflict} 的输出文件冲突: {os.path.relpath(output_path, output_dir)}")
+                        continue
+                    queue.append((name, kind, input_path, output_path))
+                
+                names = {job[0] for job in jobs}
+                pending = {name: value for name, value in pending.items() if name in names}
+                state.prune(names | active)
+                
+                while queue and len(running) < workers:
+                    job = queue.popleft()
+                    name, kind, input_path, output_path = job
+                    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                    state.update(name, status='running', started=time.time())
+                    log(f"▶️  {name}")
+                    running[pool.submit(
+                        _watch_process_job, kind, input_path, output_path, watermark_text, font_size, xobject, pages
+                    )] = job
+                
+                if once and not queue and not running and not pending:
+                    break
+                if not running:
+                    stop.wait(interval)
+                    continue
+                
+                finished, _ = wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+                broken = []
+                for future in finished:
+                    job = running.pop(future)
+                    try:
+                        page_count, stats = future.result()
+                    except BrokenProcessPool:
+                        broken.append(job)
+                    except Exception as e:
+                        finish(job, error=e)
+                    else:
+                        finish(job, page_count, stats)
+                if broken:
+                    # 工作进程异常退出（如内存不足被杀），重建进程池；受影响的文件重新排队，多次失败后标记为失败
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._watch_pool(workers)
+                    broken.extend(running.values())
+                    running.clear()
+                    for job in broken:
+                        attempts = state.get(job[0]).get('attempts', 0) + 1
+                        if attempts >= WATCH_MAX_ATTEMPTS:
+                            finish(job, error='工作进程异常退出')
+                        else:
+                            state.update(job[0], status='queued', attempts=attempts)
+                            queue.append(job)
+            
+            # 正常停止：等正在处理的文件完成
+            if running:
+                log(f"等待 {len(running)} 个正在处理的文件完成...")
+            for future, job in list(running.items()):
+                try:
+                    page_count, stats = future.result()
+                except Exception as e:
+                    finish(job, error=e)
+                else:
+                    finish(job, page_count, stats)
+            running.clear()
+        except KeyboardInterrupt:
+            self.report("\n⚠️  已中断，未完成的文件下次启动时重新处理")
+        finally:
+            pool.shutdown(wait=not running, cancel_futures=True)
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+        
+        elapsed = max(time.perf_counter() - self.stats.started, 1e-6)
+        self.report("\n" + "=" * 70)
+        self.report("✅ 监视结束")
+        self.report(f"📄 成功: {processed} 个，失败: {failed} 个，共 {total_pages} 页")
+        self.report(f"⏱️  运行时间: {elapsed:.2f} 秒")
+        self.report("=" * 70)
+        self.stats.details.update(files=processed, failed=failed)
+        return self.finish_stats(failed == 0)
 
     def show_result(self, output_path, watermark_text, font_size):
         """显示处理结果"""
-        print("\n" + "=" * 70)
-        print("✅ 处理完成！")
-        print(f"📄 输出文件: {output_path}")
+        self.report("\n" + "=" * 70)
+        self.report("✅ 处理完成！")
+        self.report(f"📄 输出文件: {output_path}")
         
-        if os.path.exists(output_path):
+        if isinstance(output_path, (str, os.PathLike)) and os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
-            print(f"💾 文件大小: {file_size / 1024 / 1024:.2f} MB")
+            self.report(f"💾 文件大小: {file_size / 1024 / 1024:.2f} MB")
         
-        print(f"\n🏷️  水印设置:")
-        print(f"   • 文字内容: {watermark_text}")
-        print(f"   • 字体大小: {font_size}px")
-        print(f"   • 透明度: {int(self.default_opacity * 100)}%")
-        print(f"   • 旋转角度: {self.default_rotation}°")
-        print("=" * 70)
+        self.report(f"\n🏷️  水印设置:")
+        self.report(f"   • 文字内容: {watermark_text}")
+        self.report(f"   • 字体大小: {font_size}px")
+        self.report(f"   • 透明度: {int(self.default_opacity * 100)}%")
+        self.report(f"   • 旋转角度: {self.default_rotation}°")
+        self.report("=" * 70)
 
 def show_usage():
     """显示使用说明"""
@@ -290,19 +2742,47 @@ def show_usage():
     print("📋 支持的功能:")
     print("   1️⃣  文件夹图片转PDF并添加水印")
     print("   2️⃣  现有PDF文件添加水印")
+    print("   3️⃣  批量为目录树中的PDF添加水印")
+    print("   4️⃣  监视文件夹，新放入的PDF和图片文件夹写完后自动添加水印")
     print()
     print("🚀 使用方法:")
-    print("   python3 watermark_tool.py [模式] [输入路径] [输出路径] [水印文字] [字体大小]")
+    print("   python3 watermark_tool.py [选项] [模式] [输入路径] [输出路径] [水印文字] [字体大小]")
     print()
     print("📝 参数说明:")
     print("   模式:")
-    print("     folder  - 处理图片文件夹")
+    print("     folder  - 处理图片文件夹 (也可以直接给出图片ZIP包，不需要先解压)")
     print("     pdf     - 处理PDF文件")
-    print("   输入路径  - 图片文件夹路径或PDF文件路径")
-    print("   输出路径  - 输出PDF文件路径")
+    print("     batch   - 批量处理目录树中的所有PDF (输出到镜像目录，跳过已是最新的文件)")
+    print("     watch   - 持续监视输入目录，新放入的PDF、图片文件夹和ZIP包写完后自动处理 (状态记录在输出目录的 watch_status.json)")
+    print("   输入路径  - 图片文件夹或ZIP包路径、PDF文件路径或批量/监视模式的输入目录")
+    print("   输出路径  - 输出PDF文件路径或批量/监视模式的输出目录")
     print("   水印文字  - 水印文字内容 (可选，默认: 朋阳托辅内部专用资料)")
     print("   字体大小  - 水印字体大小 (可选，默认: 32)")
     print()
+    print("   选项:")
+    print("     --xobject   - 水印只写入一次并在各页引用 (Form XObject)，输出文件更小")
+    print("     --workers=N - PDF模式下用N个进程按页并行添加水印；批量/监视模式下用N个进程并行处理文件")
+    print("     --incremental - PDF模式下以增量更新方式输出：原文件内容不变，只在末尾追加水印")
+    print("     --stream    - PDF模式下每处理完一页立即写出，不在内存中保留整个输出文件")
+    print("     --cache=目录 - 使用结果缓存：相同输入和水印参数直接复用上次的输出 (folder/pdf模式)")
+    print("     --cache-size=MB - 结果缓存的大小上限，超出时删除最久未使用的结果 (默认: 1024)")
+    print("     --mmap      - PDF/批量模式下以内存映射方式读取输入，由系统页缓存按需载入，适合超大PDF")
+    print("     --settle=秒 - 监视模式下输入的大小和修改时间保持不变多少秒后才处理 (默认: 5)")
+    print("     --interval=秒 - 监视模式下扫描输入目录的间隔 (默认: 2)")
+    print("     --once      - 监视模式下处理完当前已有的文件后退出")
+    print("     --pages=页码 - PDF/批量/监视模式下只为选中的页面添加水印，其余页面原样复制 (如 1-3,last、*/2、10-)")
+    print("     --compact   - 写出后做输出优化：合并相同对象、压缩内容流、使用对象流和交叉引用流，显示优化前后大小")
+    print("     --stats=文件 - 把各阶段耗时和计数以JSON行追加写入文件 (--stats 或 --stats=- 输出到屏幕)")
+    print("     --decode-workers=N - 文件夹模式下用N个线程并行解码图片 (默认: min(4, CPU核数))")
+    print("     --dpi=N     - 文件夹模式下把分辨率高于N的图片缩小到N dpi (页面大小不变)，显示每页和总共节省的大小")
+    print("     --source-dpi=N - 图片没有记录分辨率时按N dpi计算 (默认: 不缩小这类图片)")
+    print("     --image-format=jpeg|png - 文件夹模式下写入PDF的图片格式 (png为无损压缩)")
+    print("     --quality=N - 文件夹模式下重新压缩JPEG的质量 (1-95，默认: 75)")
+    print("     --raster    - 文件夹模式下把水印烧进图片像素，无法从PDF中删除 (图片需重新压缩)")
+    print("     --fragments=目录 - 文件夹模式下缓存每页处理好的图片，再次生成时只处理新增或修改过的图片")
+    print()
+    print("   环境变量 WATERMARK_FONT - 中文字体文件或字体目录 (可选，Linux服务器如 /usr/share/fonts/truetype/wqy)")
+    print()
     print("💡 使用示例:")
     print("   # 文件夹转PDF加水印")
     print("   python3 watermark_tool.py folder /path/to/images /path/output.pdf")
@@ -311,6 +2791,15 @@ def show_usage():
     print("   # PDF加水印")
     print("   python3 watermark_tool.py pdf /path/input.pdf /path/output.pdf")
     print("   python3 watermark_tool.py pdf /path/input.pdf /path/output.pdf \"自定义水印\" 24")
+    print("   python3 watermark_tool.py --xobject pdf /path/input.pdf /path/output.pdf")
+    print("   python3 watermark_tool.py --workers=8 pdf /path/input.pdf /path/output.pdf")
+    print("   python3 watermark_tool.py --pages=first,last pdf /path/input.pdf /path/output.pdf")
+    print()
+    print("   # 批量处理目录树")
+    print("   python3 watermark_tool.py --workers=8 batch /path/input_dir /path/output_dir")
+    print()
+    print("   # 监视扫描仪的共享目录")
+    print("   python3 watermark_tool.py --workers=4 watch /srv/scans /srv/scans_watermarked")
     print()
     print("🎨 字体大小建议:")
     print("   • 20-24px: 小字体，密集布局")
@@ -319,33 +2808,92 @@ def show_usage():
     print("   • 44px+:   超大字体，稀疏布局")
     print("=" * 80)
 
+def parse_args(argv):
+    """拆分命令行参数：以 -- 开头的为选项（--名称 或 --名称=值），其余为位置参数"""
+    args = []
+    options = {}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            options[name] = value if value else True
+        else:
+            args.append(arg)
+    return args, options
+
 def main():
     """主程序"""
-    tool = WatermarkTool()
+    args, options = parse_args(sys.argv[1:])
+    # 不带值的 --stats 输出到屏幕
+    stats_log = options.get('stats')
+    if stats_log is not None and not isinstance(stats_log, str):
+        stats_log = '-'
+    result_cache = None
+    if isinstance(options.get('cache'), str):
+        cache_size = int(options.get('cache-size', 1024)) * 1024 * 1024
+        result_cache = ResultCache(options['cache'], cache_size)
+    tool = WatermarkTool(
+        stats_log=stats_log, result_cache=result_cache, mmap_input=bool(options.get('mmap')),
+        compact_output=bool(options.get('compact'))
+    )
     
     # 检查参数
-    if len(sys.argv) < 4:
+    if len(args) < 3:
         show_usage()
         return
     
-    mode = sys.argv[1].lower()
-    input_path = sys.argv[2]
-    output_path = sys.argv[3]
+    mode = args[0].lower()
+    input_path = args[1]
+    output_path = args[2]
     
     # 可选参数
-    watermark_text = sys.argv[4] if len(sys.argv) > 4 else None
-    font_size = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    watermark_text = args[3] if len(args) > 3 else None
+    font_size = int(args[4]) if len(args) > 4 else None
+    xobject = bool(options.get('xobject'))
+    workers = int(options.get('workers', 1))
+    incremental = bool(options.get('incremental'))
+    stream = bool(options.get('stream'))
+    pages = options['pages'] if isinstance(options.get('pages'), str) else None
+    if pages is not None:
+        try:
+            PageSelection(pages)
+        except ValueError as e:
+            print(f"❌ 错误：{e}")
+            return
+    decode_workers = int(options['decode-workers']) if 'decode-workers' in options else None
     
     # 根据模式执行相应功能
     if mode == 'folder':
-        success = tool.process_folder_to_pdf(input_path, output_path, watermark_text, font_size)
+        success = tool.process_folder_to_pdf(
+            input_path, output_path, watermark_text, font_size, decode_workers,
+            target_dpi=float(options['dpi']) if 'dpi' in options else None,
+            image_format=options.get('image-format'),
+            jpeg_quality=int(options['quality']) if 'quality' in options else None,
+            source_dpi=float(options['source-dpi']) if 'source-dpi' in options else None,
+            raster=bool(options.get('raster')),
+            fragment_dir=options['fragments'] if isinstance(options.get('fragments'), str) else None
+        )
     elif mode == 'pdf':
-        success = tool.process_pdf_watermark(input_path, output_path, watermark_text, font_size)
+        success = tool.process_pdf_watermark(
+            input_path, output_path, watermark_text, font_size, xobject, workers, incremental, stream, pages=pages
+        )
+    elif mode == 'batch':
+        success = tool.process_batch(input_path, output_path, watermark_text, font_size, xobject, workers, pages)
+    elif mode == 'watch':
+        success = tool.watch(
+            input_path, output_path, watermark_text, font_size, xobject, workers, pages,
+            settle=float(options.get('settle', 5)), interval=float(options.get('interval', 2)),
+            once=bool(options.get('once'))
+        )
     else:
-        print("❌ 错误：不支持的模式，请使用 'folder' 或 'pdf'")
+        print("❌ 错误：不支持的模式，请使用 'folder'、'pdf'、'batch' 或 'watch'")
         show_usage()
         return
     
+    if result_cache is not None:
+        cache_stats = result_cache.stats()
+        print(f"\n♻️  结果缓存: 命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+              f"共 {cache_stats['entries']} 个结果 {cache_stats['bytes'] / 1024 / 1024:.2f} MB")
+    
     if success:
         print("\n🎉 任务执行成功！")
     else:
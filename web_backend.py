@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF水印工具 - Web后端
+提交任务、查询状态、下载结果、推送进度等接口，web_watermark_app.py 和 app.py 共用
+"""
+
+from flask import Blueprint, Response, current_app, request, send_file, jsonify, stream_with_context
+import os
+import json
+import shutil
+from urllib.parse import quote
+import tempfile
+from werkzeug.utils import secure_filename
+from watermark_tool import PageSelection, ResultCache
+from job_queue import JobQueue, OutputPipe, QueueFullError
+from upload_spool import SpoolingRequest, UploadSpool
+
+SSE_KEEPALIVE = 15  # 秒，无更新时发送注释行保持连接
+
+backend = Blueprint('watermark_backend', __name__)
+
+
+class WatermarkBackend:
+    """一个应用的处理后端：水印工具类、默认水印文字、任务队列和结果缓存"""
+
+    def __init__(self, app, tool_class, default_text):
+        self.config = app.config
+        self.tool_class = tool_class
+        self.default_text = default_text
+        self.job_queue = JobQueue(
+            app.config['JOB_WORKERS'], app.config['JOB_QUEUE_DEPTH'], app.config['JOB_RESULT_TTL']
+        )
+        self.result_cache = None
+        if app.config['RESULT_CACHE_SIZE_MB'] > 0:
+            self.result_cache = ResultCache(
+                app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_SIZE_MB'] * 1024 * 1024
+            )
+
+
+def init_app(app, tool_class, default_text):
+    """按环境变量配置应用，创建任务队列和结果缓存并注册接口，返回 WatermarkBackend
+
+    tool_class 为处理文件使用的水印工具类，default_text 为请求未给出水印文字时的默认值。
+    """
+    app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB限制
+
+    # 上传文件边接收边计算摘要、嗅探页数；不超过该大小的文件保存在内存中
+    app.request_class = SpoolingRequest
+    app.config['UPLOAD_SPOOL_MEMORY'] = int(os.environ.get('WATERMARK_SPOOL_MEMORY_KB', 1024)) * 1024
+    # PDF页数上限（按上传时嗅探的页数在入队前判断），0为不限制
+    app.config['MAX_PAGES'] = int(os.environ.get('WATERMARK_MAX_PAGES', 0))
+    # 以内存映射方式读取上传的PDF，大文件不占用进程私有内存
+    app.config['MMAP_INPUT'] = os.environ.get('WATERMARK_MMAP', '1') != '0'
+    # 设为1时写出后做输出优化（合并相同对象、压缩内容流、对象流），减小下载体积；默认关闭
+    app.config['COMPACT_OUTPUT'] = os.environ.get('WATERMARK_COMPACT', '0') == '1'
+    # 文件夹模式：分辨率高于该值的图片缩小后再写入PDF（0为不缩小），以及重新压缩的JPEG质量
+    app.config['TARGET_DPI'] = int(os.environ.get('WATERMARK_TARGET_DPI', 0))
+    app.config['JPEG_QUALITY'] = int(os.environ.get('WATERMARK_JPEG_QUALITY', 0))
+
+    # 后台任务队列：并发数、排队上限和结果保留时间（秒）可通过环境变量配置
+    app.config['JOB_WORKERS'] = int(os.environ.get('WATERMARK_JOB_WORKERS', 2))
+    app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('WATERMARK_QUEUE_DEPTH', 16))
+    app.config['JOB_RESULT_TTL'] = int(os.environ.get('WATERMARK_JOB_TTL', 3600))
+
+    # 结果缓存：相同文件和水印参数直接返回上次的结果；大小上限为0时关闭
+    app.config['RESULT_CACHE_DIR'] = os.environ.get(
+        'WATERMARK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'pdf_watermark_cache')
+    )
+    app.config['RESULT_CACHE_SIZE_MB'] = int(os.environ.get('WATERMARK_CACHE_SIZE_MB', 1024))
+
+    state = WatermarkBackend(app, tool_class, default_text)
+    app.extensions['watermark_backend'] = state
+    app.register_blueprint(backend)
+    return state
+
+def current_backend():
+    """当前应用的 WatermarkBackend"""
+    return current_app.extensions['watermark_backend']
+
+def run_watermark_job(state, job, mode, input_path, watermark_text, font_size, input_digest=None, pages=None,
+                      output=None):
+    """后台线程中执行的水印任务
+
+    input_digest 为上传时算好的输入摘要（用于结果缓存）；pages 为PDF模式下要添加水印的页码（None 为全部）。
+    output 为None时结果写入任务目录并返回文件路径；否则边处理边写入 output（流式响应），返回None。
+    """
+    tool = state.tool_class(
+        progress=job.progress, result_cache=state.result_cache, mmap_input=state.config['MMAP_INPUT'],
+        compact_output=state.config['COMPACT_OUTPUT']
+    )
+    stream = output is not None
+
+    if mode == 'pdf':
+        # PDF模式
+        output_path = output if stream else os.path.join(job.work_dir, 'output_watermarked.pdf')
+        success = tool.process_pdf_watermark(
+            input_path, output_path, watermark_text, font_size, stream=stream, input_digest=input_digest,
+            pages=pages
+        )
+    else:
+        # 文件夹模式：直接从ZIP中读取图片，不解压到磁盘
+        output_path = output if stream else os.path.join(job.work_dir, 'output_from_images.pdf')
+        success = tool.process_folder_to_pdf(
+            input_path, output_path, watermark_text, font_size, input_digest=input_digest,
+            target_dpi=state.config['TARGET_DPI'] or None, jpeg_quality=state.config['JPEG_QUALITY'] or None
+        )
+
+    # 输入已不再需要，只保留结果文件供下载
+    os.remove(input_path)
+    if not success:
+        raise RuntimeError('处理失败')
+    return None if stream else output_path
+
+def stream_watermark_job(state, job, pipe, *args):
+    """流式任务：输出写入管道，结束（或出错）后关闭管道并删除任务目录"""
+    try:
+        run_watermark_job(state, job, *args, output=pipe)
+    except Exception as e:
+        pipe.close(e)
+        raise
+    else:
+        pipe.close()
+    finally:
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+def stream_response(job, pipe):
+    """以分块传输编码把处理中的输出直接发送给客户端"""
+    # 等到第一块数据再发送响应头，处理一开始就失败时仍可返回错误状态码
+    try:
+        first = pipe.read()
+    except Exception as e:
+        pipe.cancel()
+        return f'处理出错: {str(e)}', 500
+    
+    def generate():
+        try:
+            chunk = first
+            while chunk is not None:
+                yield chunk
+                chunk = pipe.read()
+        finally:
+            # 客户端断开时终止处理
+            pipe.cancel()
+    
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"watermarked.pdf\"; filename*=UTF-8''{quote(job.download_name)}",
+        'X-Job-Id': job.id,
+    }
+    return Response(generate(), mimetype='application/pdf', headers=headers)
+
+def job_response(job, status_code=200):
+    """任务状态及相关接口地址"""
+    info = job.to_dict()
+    info['statusUrl'] = f"/jobs/{job.id}"
+    info['progressUrl'] = f"/progress/{job.id}"
+    info['downloadUrl'] = f"/jobs/{job.id}/download"
+    return jsonify(info), status_code
+
+@backend.route('/process', methods=['POST'])
+def process_file():
+    """提交处理任务，立即返回任务ID（202），处理在后台进行
+
+    带 stream=1 参数时改为在响应中直接以分块传输发送处理中的输出，结果不在服务器上保存。
+    """
+    state = current_backend()
+    work_dir = None
+    try:
+        # 获取参数
+        mode = request.form.get('mode', 'pdf')
+        watermark_text = request.form.get('watermarkText', state.default_text)
+        font_size = int(request.form.get('fontSize', 32))
+        pages = request.form.get('pages', '').strip() or None
+        
+        if 'file' not in request.files:
+            return '没有上传文件', 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return '没有选择文件', 400
+        
+        if state.job_queue.full():
+            return '服务器繁忙，请稍后重试', 503, {'Retry-After': '30'}
+        
+        # 上传时已得到内容摘要、文件类型和页数估计，不符合要求的请求不进入队列
+        upload = file.stream if isinstance(file.stream, UploadSpool) else None
+        input_digest = upload.sha256 if upload is not None else None
+        if upload is not None and mode == 'pdf':
+            if not upload.is_pdf:
+                return '上传的文件不是PDF', 400
+            max_pages = current_app.config['MAX_PAGES']
+            if max_pages and upload.page_count and upload.page_count > max_pages:
+                return f'PDF约有 {upload.page_count} 页，超过上限 {max_pages} 页', 413
+        if pages is not None and mode == 'pdf':
+            try:
+                PageSelection(pages)
+            except ValueError as e:
+                return str(e), 400
+        
+        # 上传文件保存到任务工作目录，处理完成前一直保留（已转存到磁盘的上传直接改名）
+        work_dir = state.job_queue.create_work_dir()
+        input_path = os.path.join(work_dir, secure_filename(file.filename) or 'input')
+        if upload is not None:
+            upload.save(input_path)
+        else:
+            file.save(input_path)
+        
+        output_filename = f"{os.path.splitext(file.filename)[0]}_带水印.pdf"
+        if request.values.get('stream') == '1':
+            pipe = OutputPipe()
+            job = state.job_queue.submit(
+                lambda job: stream_watermark_job(
+                    state, job, pipe, mode, input_path, watermark_text, font_size, input_digest, pages
+                ),
+                work_dir, output_filename
+            )
+            work_dir = None
+            return stream_response(job, pipe)
+        
+        job = state.job_queue.submit(
+            lambda job: run_watermark_job(state, job, mode, input_path, watermark_text, font_size, input_digest, pages),
+            work_dir, output_filename
+        )
+        work_dir = None
+        return job_response(job, 202)
+        
+    except QueueFullError:
+        work_dir = None
+        return '服务器繁忙，请稍后重试', 503, {'Retry-After': '30'}
+    except Exception as e:
+        return f'处理出错: {str(e)}', 500
+    finally:
+        # 任务未能提交时删除工作目录
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+@backend.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询任务状态"""
+    state = current_backend()
+    job = state.job_queue.get(job_id)
+    if job is None:
+        return '任务不存在或已过期', 404
+    return job_response(job)
+
+@backend.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    """下载已完成任务的结果文件"""
+    state = current_backend()
+    job = state.job_queue.get(job_id)
+    if job is None:
+        return '任务不存在或已过期', 404
+    if job.status == 'failed':
+        return f'处理失败: {job.error}', 500
+    if job.status != 'done':
+        return '任务尚未完成', 409
+    if job.result is None:
+        return '流式任务的结果已直接发送，不在服务器上保存', 410
+    return send_file(
+        job.result,
+        as_attachment=True,
+        download_name=job.download_name,
+        mimetype='application/pdf'
+    )
+
+@backend.route('/progress/<job_id>')
+def progress_events(job_id):
+    """以Server-Sent Events推送任务进度（已完成/总数、已用时间、预计剩余时间）"""
+    state = current_backend()
+    job = state.job_queue.get(job_id)
+    if job is None:
+        return '任务不存在或已过期', 404
+    channel = job.progress
+    
+    def generate():
+        version = 0
+        while True:
+            current, event, finished = channel.wait(version, SSE_KEEPALIVE)
+            if current != version:
+                version = current
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            elif not finished:
+                yield ": keepalive\n\n"
+            if finished:
+                yield f"event: done\ndata: {json.dumps({'status': job.status, 'error': job.error}, ensure_ascii=False)}\n\n"
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@backend.route('/cache')
+def cache_stats():
+    """结果缓存统计：命中/未命中次数、命中率、结果数量和总大小"""
+    state = current_backend()
+    if state.result_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **state.result_cache.stats()})
+
+@backend.route('/health')
+def health():
+    """健康检查"""
+    return {'status': 'ok', 'message': 'PDF水印工具运行正常'}
@@ -6,16 +6,13 @@ PDF水印工具 - Web版本
 可部署到Vercel等平台
 """
 
-from flask import Flask, request, send_file, render_template_string, jsonify
-import os
-import tempfile
-import zipfile
-from werkzeug.utils import secure_filename
-import io
+from flask import Flask, render_template_string
 from watermark_tool import WatermarkTool
+import web_backend
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB限制
+# 处理接口（提交任务、查询状态、下载、进度、缓存统计）见 web_backend
+web_backend.init_app(app, WatermarkTool, '朋阳托辅内部专用资料')
 
 # HTML模板
 HTML_TEMPLATE = '''
@@ -195,6 +192,11 @@ HTML_TEMPLATE = '''
                                oninput="document.getElementById('fontSizeValue').textContent = this.value">
                         <span id="fontSizeValue">32</span> px
                     </div>
+                    <div class="form-group">
+                        <label for="pages">水印页码 (PDF模式，可选)</label>
+                        <input type="text" id="pages" name="pages" 
+                               placeholder="留空为全部页面，如 1-3,last 或 */2">
+                    </div>
                 </div>
                 
                 <button type="submit" class="btn" id="submitBtn">
@@ -203,7 +205,7 @@ HTML_TEMPLATE = '''
             </form>
             
             <div class="progress" id="progress">
-                <p>正在处理中，请稍候...</p>
+                <p id="progressText">正在处理中，请稍候...</p>
                 <div class="progress-bar">
                     <div class="progress-fill" id="progressFill"></div>
                 </div>
@@ -240,6 +242,8 @@ HTML_TEMPLATE = '''
         const progress = document.getElementById('progress');
         const result = document.getElementById('result');
         const fileInput = document.getElementById('fileInput');
+        const progressFill = document.getElementById('progressFill');
+        const progressText = document.getElementById('progressText');
         const modeRadios = document.querySelectorAll('input[name="mode"]');
         
         // 根据模式切换文件类型
@@ -261,6 +265,7 @@ HTML_TEMPLATE = '''
             const mode = document.querySelector('input[name="mode"]:checked').value;
             const watermarkText = document.getElementById('watermarkText').value;
             const fontSize = document.getElementById('fontSize').value;
+            const pages = document.getElementById('pages').value;
             
             if (!file) {
                 alert('请选择文件');
@@ -271,36 +276,62 @@ HTML_TEMPLATE = '''
             formData.append('mode', mode);
             formData.append('watermarkText', watermarkText);
             formData.append('fontSize', fontSize);
+            formData.append('pages', pages);
             
             // 显示进度
             submitBtn.disabled = true;
+            progressFill.style.width = '0%';
+            progressText.textContent = '正在上传，请稍候...';
             progress.style.display = 'block';
             result.style.display = 'none';
             
             try {
+                // 提交任务，立即返回任务ID
                 const response = await fetch('/process', {
                     method: 'POST',
                     body: formData
                 });
+                if (!response.ok) {
+                    throw new Error(await response.text());
+                }
+                const job = await response.json();
+                progressText.textContent = '排队等待处理...';
+                
+                // 订阅处理进度（SSE），结束后查询最终状态
+                await new Promise(resolve => {
+                    const events = new EventSource(job.progressUrl);
+                    events.onmessage = function(e) {
+                        const ev = JSON.parse(e.data);
+                        if (!ev.total) return;
+                        progressFill.style.width = `${(ev.done / ev.total * 100).toFixed(1)}%`;
+                        let text = `已处理 ${ev.done}/${ev.total} 页`;
+                        if (ev.eta !== null && ev.done < ev.total) {
+                            text += `，预计剩余 ${Math.ceil(ev.eta)} 秒`;
+                        }
+                        progressText.textContent = text;
+                    };
+                    events.addEventListener('done', () => { events.close(); resolve(); });
+                    events.onerror = () => { events.close(); resolve(); };
+                });
                 
-                if (response.ok) {
-                    const blob = await response.blob();
-                    const url = window.URL.createObjectURL(blob);
-                    const filename = response.headers.get('Content-Disposition')
-                        .split('filename=')[1].replace(/"/g, '');
-                    
-                    document.getElementById('downloadLink').href = url;
-                    document.getElementById('downloadLink').download = filename;
-                    document.getElementById('resultMessage').textContent = 
-                        `文件处理完成！大小: ${(blob.size / 1024 / 1024).toFixed(2)} MB`;
-                    
-                    result.style.display = 'block';
-                } else {
-                    const error = await response.text();
-                    alert('处理失败: ' + error);
+                // SSE中断时轮询任务状态
+                let status = await (await fetch(job.statusUrl)).json();
+                while (status.status === 'queued' || status.status === 'running') {
+                    await new Promise(resolve => setTimeout(resolve, 2000));
+                    status = await (await fetch(job.statusUrl)).json();
                 }
+                if (status.status !== 'done') {
+                    throw new Error(status.error || '处理失败');
+                }
+                
+                progressFill.style.width = '100%';
+                document.getElementById('downloadLink').href = job.downloadUrl;
+                document.getElementById('resultMessage').textContent = 
+                    `文件处理完成！大小: ${(status.size / 1024 / 1024).toFixed(2)} MB`;
+                
+                result.style.display = 'block';
             } catch (error) {
-                alert('上传失败: ' + error.message);
+                alert('处理失败: ' + error.message);
             } finally {
                 submitBtn.disabled = false;
                 progress.style.display = 'none';
@@ -316,70 +347,5 @@ def index():
     """主页"""
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/process', methods=['POST'])
-def process_file():
-    """处理上传的文件"""
-    try:
-        # 获取参数
-        mode = request.form.get('mode', 'pdf')
-        watermark_text = request.form.get('watermarkText', '朋阳托辅内部专用资料')
-        font_size = int(request.form.get('fontSize', 32))
-        
-        if 'file' not in request.files:
-            return '没有上传文件', 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return '没有选择文件', 400
-        
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, secure_filename(file.filename))
-            file.save(input_path)
-            
-            tool = WatermarkTool()
-            
-            if mode == 'pdf':
-                # PDF模式
-                output_path = os.path.join(temp_dir, 'output_watermarked.pdf')
-                success = tool.process_pdf_watermark(
-                    input_path, output_path, watermark_text, font_size
-                )
-                output_filename = f"{os.path.splitext(file.filename)[0]}_带水印.pdf"
-                
-            else:
-                # 文件夹模式
-                extract_dir = os.path.join(temp_dir, 'extracted')
-                os.makedirs(extract_dir)
-                
-                # 解压ZIP文件
-                with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                
-                output_path = os.path.join(temp_dir, 'output_from_images.pdf')
-                success = tool.process_folder_to_pdf(
-                    extract_dir, output_path, watermark_text, font_size
-                )
-                output_filename = f"{os.path.splitext(file.filename)[0]}_带水印.pdf"
-            
-            if not success:
-                return '处理失败', 500
-            
-            # 返回处理后的文件
-            return send_file(
-                output_path,
-                as_attachment=True,
-                download_name=output_filename,
-                mimetype='application/pdf'
-            )
-            
-    except Exception as e:
-        return f'处理出错: {str(e)}', 500
-
-@app.route('/health')
-def health():
-    """健康检查"""
-    return {'status': 'ok', 'message': 'PDF水印工具运行正常'}
-
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)